@@ -0,0 +1,142 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+import uuid
+from collections import OrderedDict
+
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+log = logging.getLogger("foodbridge.auth")
+
+# Signing key shared by every worker; without it each process signs with its own random key
+AUTH_SECRET = os.getenv("AUTH_SECRET")
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL", "900"))
+REFRESH_TOKEN_TTL = int(os.getenv("REFRESH_TOKEN_TTL", str(14 * 24 * 3600)))
+REVOKED_TOKEN_CAPACITY = int(os.getenv("REVOKED_TOKEN_CAPACITY", "100000"))
+
+if not AUTH_SECRET:
+    log.warning("AUTH_SECRET is not set; tokens will only be valid in this process until it restarts")
+    AUTH_SECRET = secrets.token_urlsafe(32)
+
+_key = AUTH_SECRET.encode()
+
+
+class Principal:
+    """Who a validated access token was issued to."""
+
+    def __init__(self, subject: str, kind: str, token_id: str, expires_at: int):
+        self.subject = subject  # User or community centre id
+        self.kind = kind  # "user" or "centre"
+        self.token_id = token_id
+        self.expires_at = expires_at
+
+
+class RevokedTokens:
+    """
+    LRU set of revoked token ids. Entries are dropped once the token would have
+    expired anyway; past capacity the oldest revocation goes first.
+    """
+
+    def __init__(self, capacity: int = REVOKED_TOKEN_CAPACITY):
+        self.capacity = capacity
+        self._entries = OrderedDict()  # token id -> expiry
+
+    def __contains__(self, token_id: str) -> bool:
+        return token_id in self._entries
+
+    def add(self, token_id: str, expires_at: int):
+        now = time.time()
+        while self._entries:
+            oldest, oldest_expiry = next(iter(self._entries.items()))
+            if oldest_expiry > now and len(self._entries) < self.capacity:
+                break
+            del self._entries[oldest]
+        self._entries[token_id] = expires_at
+        self._entries.move_to_end(token_id)
+
+
+revoked_tokens = RevokedTokens()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(_key, payload.encode(), hashlib.sha256).digest())
+
+
+def _encode(claims: dict) -> str:
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def _decode(token: str, token_type: str) -> dict:
+    """Claims of a token we signed, of the given type, that hasn't expired or been revoked."""
+    invalid = HTTPException(status_code=401, detail="Invalid or expired token", headers={"WWW-Authenticate": "Bearer"})
+    # compare_digest raises TypeError on non-ASCII str, and tokens we sign are base64url
+    if not token.isascii():
+        raise invalid
+    payload, _, signature = token.partition(".")
+    if not hmac.compare_digest(signature, _sign(payload)):
+        raise invalid
+    try:
+        claims = json.loads(_b64decode(payload))
+    except (binascii.Error, ValueError):
+        raise invalid
+    if claims.get("typ") != token_type or claims.get("exp", 0) <= time.time() or claims.get("jti") in revoked_tokens:
+        raise invalid
+    return claims
+
+
+def issue_tokens(subject: str, kind: str) -> dict:
+    """A new access token and refresh token for a user or centre."""
+    now = int(time.time())
+
+    def token(token_type: str, ttl: int) -> str:
+        return _encode({"sub": subject, "kind": kind, "typ": token_type, "jti": uuid.uuid4().hex, "iat": now, "exp": now + ttl})
+
+    return {
+        "access_token": token("access", ACCESS_TOKEN_TTL),
+        "refresh_token": token("refresh", REFRESH_TOKEN_TTL),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_TTL,
+    }
+
+
+def refresh_tokens(refresh_token: str) -> dict:
+    """Exchange a refresh token for a new pair; the old refresh token can't be used again."""
+    claims = _decode(refresh_token, "refresh")
+    revoked_tokens.add(claims["jti"], claims["exp"])
+    return issue_tokens(claims["sub"], claims["kind"])
+
+
+def revoke(token: str, token_type: str):
+    """Revoke a token if it is valid; invalid tokens are already unusable, so they're ignored."""
+    try:
+        claims = _decode(token, token_type)
+    except HTTPException:
+        return
+    revoked_tokens.add(claims["jti"], claims["exp"])
+
+
+_bearer = HTTPBearer(auto_error=False)
+
+
+def require_principal(credentials: HTTPAuthorizationCredentials = Depends(_bearer)) -> Principal:
+    """Dependency for authenticated endpoints; checks the access token in memory, without the database."""
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    claims = _decode(credentials.credentials, "access")
+    return Principal(claims["sub"], claims["kind"], claims["jti"], claims["exp"])
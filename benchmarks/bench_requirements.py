@@ -0,0 +1,152 @@
+"""
+Requirement upsert and today's-requirements lookup latency vs table size.
+
+Compares the old access path (no secondary indexes, SELECT then UPDATE/INSERT)
+with the current one (composite indexes, single native upsert) on a local
+SQLite file. The number of centres is fixed and the table grows by days of
+history, so every lookup returns the same CENTRES rows and the timings show
+how each path scales with table size. The upserts time only the write
+statements and their commit, not the checks, events and matching around them
+in crud.create_or_update_requirement. Run from the repository root:
+
+    python -m benchmarks.bench_requirements --sizes 1000 10000 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import crud, models, schemas
+from database import Base
+
+MEALS = ["breakfast", "lunch", "dinner"]
+# Rows each today's-requirements lookup returns, whatever the table size
+CENTRES = 50
+# Days ahead of today that upserts update; inserts go beyond them
+UPCOMING_DAYS = 7
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1] * 1000, 3),
+    }
+
+
+async def _timed(samples, coro):
+    start = time.perf_counter()
+    await coro
+    samples.append(time.perf_counter() - start)
+
+
+async def legacy_create_or_update_requirement(db, requirement: schemas.RequirementCreate):
+    """The pre-upsert statements: SELECT, then UPDATE or INSERT."""
+    existing = await db.scalar(
+        select(models.Requirement).filter(
+            models.Requirement.date == requirement.date,
+            models.Requirement.community_centre_id == requirement.community_centre_id,
+            models.Requirement.meal_type == requirement.meal_type,
+        ).limit(1)
+    )
+    if existing:
+        existing.servings = requirement.servings
+        existing.status = requirement.status
+    else:
+        db.add(models.Requirement(id=str(uuid.uuid4()), **requirement.model_dump()))
+    await db.commit()
+
+
+async def native_upsert_requirement(db, requirement: schemas.RequirementCreate):
+    """The single upsert statement crud.create_or_update_requirement runs."""
+    await db.execute(crud.upsert_requirements_statement(
+        db.get_bind().dialect.name, [{"id": str(uuid.uuid4()), **requirement.model_dump()}],
+    ))
+    await db.commit()
+
+
+async def run_size(size: int, indexed: bool, operations: int) -> dict:
+    path = tempfile.mktemp(suffix=".db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        if not indexed:
+            for table in (models.Requirement.__table__, models.FoodItem.__table__):
+                for index in table.indexes:
+                    await conn.run_sync(index.drop)
+
+        days = max(UPCOMING_DAYS, size // (CENTRES * len(MEALS)))
+        centre_ids = [str(uuid.uuid4()) for _ in range(CENTRES)]
+        await conn.execute(insert(models.CommunityCentre), [
+            {"id": cid, "name": f"Centre {i}", "address": "-", "latitude": 0.0, "longitude": 0.0,
+             "contact": f"c{i}", "email": f"centre{i}@example.com", "password": "-"}
+            for i, cid in enumerate(centre_ids)
+        ])
+        # History up to today, plus the upcoming days
+        first_day = date.today() - timedelta(days=days - UPCOMING_DAYS)
+        await conn.execute(insert(models.Requirement), [
+            {"id": str(uuid.uuid4()), "community_centre_id": cid, "servings": 50,
+             "date": first_day + timedelta(days=d), "meal_type": meal, "status": "open"}
+            for cid in centre_ids for d in range(days) for meal in MEALS
+        ])
+
+    upsert = native_upsert_requirement if indexed else legacy_create_or_update_requirement
+    today = date.today()
+    rng = random.Random(size)
+    upsert_samples, lookup_samples = [], []
+    async with Session() as db:
+        for i in range(operations):
+            # Half updates of upcoming slots, half inserts of new days
+            day_offset = rng.randrange(UPCOMING_DAYS) if i % 2 else UPCOMING_DAYS + i
+            requirement = schemas.RequirementCreate(
+                community_centre_id=rng.choice(centre_ids), servings=rng.randint(1, 100),
+                date=today + timedelta(days=day_offset), meal_type=rng.choice(MEALS), status="open",
+            )
+            await _timed(upsert_samples, upsert(db, requirement))
+        for _ in range(operations):
+            await _timed(lookup_samples, crud.get_requirements_by_date_and_meal_type(db, today, rng.choice(MEALS)))
+
+    await engine.dispose()
+    os.remove(path)
+    return {
+        "rows": size,
+        "indexed": indexed,
+        "upsert": _percentiles(upsert_samples),
+        "today_lookup": _percentiles(lookup_samples),
+    }
+
+
+async def main(sizes, operations, output):
+    results = []
+    for size in sizes:
+        for indexed in (False, True):
+            result = await run_size(size, indexed, operations)
+            results.append(result)
+            label = "indexed + native upsert" if indexed else "no indexes + select/update"
+            print(
+                f"{size:>8} rows  {label:<27}  upsert p50 {result['upsert']['p50_ms']:>8} ms"
+                f"  today lookup p50 {result['today_lookup']['p50_ms']:>8} ms"
+            )
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--operations", type=int, default=200, help="upserts and lookups timed per size")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.operations, args.output))
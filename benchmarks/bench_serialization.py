@@ -0,0 +1,138 @@
+"""
+Large listing responses with and without serialization.FAST_RESPONSES.
+
+Seeds a SQLite file with --rows centres, requirements and food items (all of
+the food items on one requirement), then fetches every row of
+/community-centres/, /requirements/ (pages of 1000) and /food_items/{id}
+through the app in-process, first on the usual ORM + response_model path and
+then on the fast path, checking both return the same JSON. Run from the
+repository root:
+
+    python -m benchmarks.bench_serialization --rows 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import date
+
+import httpx
+from sqlalchemy import insert
+
+import database
+import models
+
+PAGE_SIZE = 1000
+USERS = 100
+
+
+def seed(engine, rows: int) -> str:
+    """Fill the database and return the id of the requirement holding every food item."""
+    database.Base.metadata.create_all(engine)
+    centre_ids = [str(uuid.uuid4()) for _ in range(rows)]
+    requirement_ids = [str(uuid.uuid4()) for _ in range(rows)]
+    user_ids = [str(uuid.uuid4()) for _ in range(USERS)]
+    with engine.begin() as conn:
+        conn.execute(insert(models.CommunityCentre), [
+            {"id": cid, "name": f"Centre {i}", "address": f"{i} High Street", "latitude": 51.5 + i / 1e5,
+             "longitude": -0.12 - i / 1e5, "contact": f"c{i}", "email": f"centre{i}@example.com", "password": "-"}
+            for i, cid in enumerate(centre_ids)
+        ])
+        conn.execute(insert(models.Requirement), [
+            {"id": rid, "community_centre_id": cid, "servings": 50, "date": date.today(), "meal_type": "lunch", "status": "open"}
+            for rid, cid in zip(requirement_ids, centre_ids)
+        ])
+        conn.execute(insert(models.User), [
+            {"id": uid, "name": f"User {i}", "address": "-", "contact": f"u{i}", "email": f"user{i}@example.com",
+             "password": "-", "token_count": i}
+            for i, uid in enumerate(user_ids)
+        ])
+        conn.execute(insert(models.FoodItem), [
+            {"id": str(uuid.uuid4()), "image": "https://example.com/food.png", "title": f"Meal {i}",
+             "description": "Rice and vegetables", "servings": 1 + i % 10, "request_id": requirement_ids[0],
+             "user_id": user_ids[i % USERS], "status": "Open"}
+            for i in range(rows)
+        ])
+    return requirement_ids[0]
+
+
+async def fetch_all(client, path: str) -> list:
+    """Every row of a listing, following X-Next-Cursor."""
+    rows, params = [], {"limit": PAGE_SIZE}
+    while True:
+        response = await client.get(path, params=params)
+        response.raise_for_status()
+        rows.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return rows
+        params["cursor"] = cursor
+
+
+async def fetch_one(client, path: str) -> list:
+    response = await client.get(path)
+    response.raise_for_status()
+    return response.json()
+
+
+async def main(rows: int, repeats: int, output):
+    path = tempfile.mktemp(suffix=".db")
+    url = f"sqlite:///{path}"
+    database.configure(url)
+    import main as app_main  # After configure, so nothing in the app touches the production URL
+    import passwords
+    import serialization
+
+    request_id = seed(database.engine, rows)
+    scenarios = {
+        "community_centres": (fetch_all, "/community-centres/"),
+        "requirements": (fetch_all, "/requirements/"),
+        "food_items_by_request": (fetch_one, f"/food_items/{request_id}"),
+    }
+
+    results = []
+    transport = httpx.ASGITransport(app=app_main.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, (fetch, url_path) in scenarios.items():
+                bodies, timings = {}, {}
+                for fast in (False, True):
+                    serialization.FAST_RESPONSES = fast
+                    bodies[fast] = await fetch(client, url_path)  # Warm up, and keep the body to compare
+                    samples = []
+                    for _ in range(repeats):
+                        start = time.perf_counter()
+                        await fetch(client, url_path)
+                        samples.append(time.perf_counter() - start)
+                    timings[fast] = round(statistics.median(samples) * 1000, 1)
+                same = bodies[False] == bodies[True]
+                results.append({
+                    "scenario": name, "rows": len(bodies[True]), "usual_p50_ms": timings[False],
+                    "fast_p50_ms": timings[True], "speedup": round(timings[False] / timings[True], 2), "same_json": same,
+                })
+                print(
+                    f"{name:<22} {len(bodies[True]):>7} rows  usual p50 {timings[False]:>8} ms"
+                    f"  fast p50 {timings[True]:>8} ms  x{results[-1]['speedup']:<5}  same JSON: {same}"
+                )
+    finally:
+        passwords.shutdown_pool()
+        await database.async_engine.dispose()
+        database.engine.dispose()
+        os.remove(path)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=5, help="timed fetches per scenario and path")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.repeats, args.output))
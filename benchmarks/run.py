@@ -0,0 +1,202 @@
+"""
+Endpoint load benchmark against a local SQLite stand-in.
+
+Points database.py at a SQLite file (seeding it with benchmarks.seed if it
+doesn't exist), then drives the app in-process through httpx's ASGI
+transport and reports throughput and p50/p99 latency per scenario. Results
+are written as JSON; pass --baseline with an earlier results file to flag
+regressions (exit status 1):
+
+    python -m benchmarks.run --scale 0.01 --output results.json
+    python -m benchmarks.run --scale 0.01 --baseline results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import httpx
+from sqlalchemy import select
+
+import database
+import models
+from benchmarks import seed
+
+
+class Context:
+    """Ids sampled from the seeded database for scenarios to pick from."""
+
+    def __init__(self, engine, sample_size: int = 5000):
+        with engine.connect() as conn:
+            def sample(stmt):
+                return list(conn.scalars(stmt.limit(sample_size)))
+
+            self.centre_ids = sample(select(models.CommunityCentre.id))
+            self.requirement_ids = sample(select(models.FoodItem.request_id).distinct())
+            self.open_food_item_ids = sample(select(models.FoodItem.id).where(models.FoodItem.status == "Open"))
+            self.user_emails = sample(select(models.User.email))
+            self.centres = conn.execute(
+                select(models.CommunityCentre.latitude, models.CommunityCentre.longitude).limit(sample_size)
+            ).all()
+
+
+async def today_requirements(client, ctx, rng):
+    return await client.get("/requirements/today/")
+
+
+async def food_items_by_request(client, ctx, rng):
+    return await client.get(f"/food_items/{rng.choice(ctx.requirement_ids)}")
+
+
+async def requests_by_centre(client, ctx, rng):
+    return await client.get(f"/requests/{rng.choice(ctx.centre_ids)}")
+
+
+async def nearby_centres(client, ctx, rng):
+    latitude, longitude = rng.choice(ctx.centres)
+    return await client.get("/community-centres/nearby", params={"latitude": latitude, "longitude": longitude, "k": 10})
+
+
+async def list_requirements_page(client, ctx, rng):
+    return await client.get("/requirements/", params={"limit": 100})
+
+
+async def status_update(client, ctx, rng):
+    # Each Open item is approved once; pop so repeated runs never hit a 409
+    return await client.put(f"/food_items/{ctx.open_food_item_ids.pop()}/status", json={"status": "Approved"})
+
+
+async def login(client, ctx, rng):
+    return await client.post("/users/login", json={"email": rng.choice(ctx.user_emails), "password": seed.PASSWORD})
+
+
+# name -> (scenario, share of --requests to send); logins are bcrypt bound, so fewer of them
+SCENARIOS = {
+    "today_requirements": (today_requirements, 1.0),
+    "food_items_by_request": (food_items_by_request, 1.0),
+    "requests_by_centre": (requests_by_centre, 1.0),
+    "nearby_centres": (nearby_centres, 1.0),
+    "list_requirements_page": (list_requirements_page, 1.0),
+    "status_update": (status_update, 1.0),
+    "login": (login, 0.1),
+}
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def run_scenario(client, ctx, scenario, requests: int, concurrency: int, rng) -> dict:
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await scenario(client, ctx, rng)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400 and response.status_code != 404:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Scenarios whose p99 rose or throughput fell by more than tolerance vs the baseline."""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        if current["p99_ms"] > previous["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {previous['p99_ms']} -> {current['p99_ms']} ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} rps")
+    return regressions
+
+
+async def main(args) -> int:
+    url = f"sqlite:///{args.db}"
+    if args.reseed or not os.path.exists(args.db):
+        print(f"Seeding {args.db} at scale {args.scale}...")
+        seed.seed(url, **seed.scaled_volumes(args.scale), rng_seed=args.seed)
+
+    database.configure(url)
+    import main as app_main  # After configure, so nothing in the app touches the production URL
+    import passwords
+
+    ctx = Context(database.engine)
+    rng = random.Random(args.seed)
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "db": args.db,
+            "scale": args.scale,
+        },
+        "scenarios": {},
+    }
+
+    transport = httpx.ASGITransport(app=app_main.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in args.scenarios:
+                scenario, share = SCENARIOS[name]
+                requests = max(1, int(args.requests * share))
+                if name == "status_update":
+                    requests = min(requests, len(ctx.open_food_item_ids) - 10)
+                await run_scenario(client, ctx, scenario, min(requests, 10), 1, rng)  # Warm caches and pools
+                result = await run_scenario(client, ctx, scenario, requests, args.concurrency, rng)
+                results["scenarios"][name] = result
+                print(
+                    f"{name:<24} {result['throughput_rps']:>9} rps  p50 {result['p50_ms']:>9} ms"
+                    f"  p99 {result['p99_ms']:>9} ms  errors {result['errors']}"
+                )
+    finally:
+        passwords.shutdown_pool()
+        await database.async_engine.dispose()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench.db", help="SQLite file to benchmark against")
+    parser.add_argument("--scale", type=float, default=1.0, help="seed volume multiplier (see benchmarks.seed)")
+    parser.add_argument("--reseed", action="store_true", help="recreate the database even if it exists")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional regression")
+    sys.exit(asyncio.run(main(parser.parse_args())))
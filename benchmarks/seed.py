@@ -0,0 +1,120 @@
+"""
+Synthetic data generator for benchmarks.
+
+Fills a database with realistic volumes of centres, users, requirements and
+food items, deterministically for a given --seed. Rows go in with bulk Core
+inserts, so the defaults (10k centres, 1M food items) take a few minutes on
+SQLite; use --scale to shrink everything proportionally:
+
+    python -m benchmarks.seed --url sqlite:///bench.db --scale 0.01
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, insert
+
+import models
+from database import Base
+from passwords import pwd_context
+
+MEALS = ["breakfast", "lunch", "dinner"]
+FOOD_STATUSES = ["Open", "Approved", "In Transit", "Received", "Not fulfilled"]
+FOODS = ["Rice", "Vegetable curry", "Bread", "Pasta", "Halal chicken", "Fruit", "Noodles", "Soup", "Sandwiches"]
+INSERT_BATCH = 10_000
+
+# Every seeded account shares this password, so login benchmarks can use any email
+PASSWORD = "benchmark-password"
+
+DEFAULT_VOLUMES = {
+    "centres": 10_000,
+    "users": 50_000,
+    "days": 7,  # Requirement dates from today - days//2, one per meal per centre per day
+    "food_items": 1_000_000,
+}
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _insert(conn, table, rows):
+    for start in range(0, len(rows), INSERT_BATCH):
+        conn.execute(insert(table), rows[start:start + INSERT_BATCH])
+
+
+def seed(url: str, centres: int, users: int, days: int, food_items: int, rng_seed: int = 42) -> dict:
+    """Create the schema at url and fill it. Returns the seeded volumes."""
+    rng = random.Random(rng_seed)
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    password = pwd_context.hash(PASSWORD)
+    first_day = date.today() - timedelta(days=days // 2)
+
+    with engine.begin() as conn:
+        centre_rows = [
+            {
+                "id": _uuid(rng), "name": f"Community Centre {i}", "address": f"{i} High Street",
+                # Clustered around a few cities, like the real data
+                "latitude": rng.choice([1.35, 51.5, 40.7, -33.9]) + rng.gauss(0, 0.3),
+                "longitude": rng.choice([103.8, -0.12, -74.0, 151.2]) + rng.gauss(0, 0.3),
+                "contact": f"6{i:07d}", "email": f"centre{i}@example.com", "password": password,
+            }
+            for i in range(centres)
+        ]
+        _insert(conn, models.CommunityCentre.__table__, centre_rows)
+
+        user_rows = [
+            {
+                "id": _uuid(rng), "name": f"Donor {i}", "address": f"{i} Donor Road",
+                "contact": f"9{i:07d}", "email": f"donor{i}@example.com", "password": password,
+                "token_count": rng.randint(0, 500),
+            }
+            for i in range(users)
+        ]
+        _insert(conn, models.User.__table__, user_rows)
+
+        requirement_rows = [
+            {
+                "id": _uuid(rng), "community_centre_id": centre["id"], "servings": rng.randint(10, 200),
+                "date": first_day + timedelta(days=day), "meal_type": meal, "status": "open",
+            }
+            for centre in centre_rows for day in range(days) for meal in MEALS
+        ]
+        _insert(conn, models.Requirement.__table__, requirement_rows)
+
+        for start in range(0, food_items, INSERT_BATCH):
+            _insert(conn, models.FoodItem.__table__, [
+                {
+                    "id": _uuid(rng), "image": f"/images/{rng.getrandbits(256):064x}",
+                    "title": rng.choice(FOODS), "description": "Freshly cooked, packed in trays",
+                    "servings": rng.randint(1, 30), "request_id": rng.choice(requirement_rows)["id"],
+                    "user_id": rng.choice(user_rows)["id"], "status": rng.choice(FOOD_STATUSES),
+                }
+                for _ in range(min(INSERT_BATCH, food_items - start))
+            ])
+
+    engine.dispose()
+    return {"centres": centres, "users": users, "requirements": len(requirement_rows), "food_items": food_items}
+
+
+def scaled_volumes(scale: float) -> dict:
+    return {
+        name: count if name == "days" else max(1, int(count * scale))
+        for name, count in DEFAULT_VOLUMES.items()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="sqlite:///bench.db", help="sync database URL to (re)create")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the default volumes")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    volumes = seed(args.url, **scaled_volumes(args.scale), rng_seed=args.seed)
+    print(f"Seeded {volumes} in {time.perf_counter() - started:.1f}s")
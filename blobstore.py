@@ -0,0 +1,178 @@
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+BLOB_DIR = os.getenv("BLOB_DIR", "blobs")
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+THUMBNAIL_SIZES = (128, 256, 512)
+CHUNK_SIZE = 1024 * 1024
+
+# What FoodItem.image stores for an uploaded image, and the download URL for it
+IMAGE_REF_PREFIX = "/images/"
+# Formats accepted into the store, by Pillow format name. Only rasters: an SVG served
+# from /images could run script in the API's origin
+IMAGE_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+_DATA_URI = re.compile(r"^data:image/[\w.+-]+;base64,(?P<data>.*)$", re.DOTALL)
+
+
+def is_digest(value: str) -> bool:
+    return bool(_DIGEST.match(value))
+
+
+def image_ref(digest: str) -> str:
+    return f"{IMAGE_REF_PREFIX}{digest}"
+
+
+def path_for(digest: str) -> str:
+    """Blobs are sharded by the first two hex pairs of their SHA-256, e.g. ab/cd/abcd..."""
+    return os.path.join(BLOB_DIR, digest[:2], digest[2:4], digest)
+
+
+def _meta_path(digest: str) -> str:
+    return path_for(digest) + ".json"
+
+
+def exists(digest: str) -> bool:
+    return is_digest(digest) and os.path.exists(path_for(digest))
+
+
+def content_type(digest: str) -> str:
+    """The stored image's media type; application/octet-stream for blobs stored with any other type."""
+    try:
+        with open(_meta_path(digest)) as f:
+            media_type = json.load(f)["content_type"]
+    except (OSError, ValueError, KeyError):
+        return "application/octet-stream"
+    return media_type if media_type in IMAGE_TYPES.values() else "application/octet-stream"
+
+
+def _open_image(path: str):
+    from PIL import Image  # Optional dependency, only needed for images
+
+    return Image.open(path, formats=list(IMAGE_TYPES))
+
+
+def _detect_type(path: str) -> str:
+    """Media type of the image at path, from its content. 415 unless it's one of IMAGE_TYPES."""
+    try:
+        from PIL import Image
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Image uploads require Pillow to be installed.")
+    try:
+        with _open_image(path) as image:
+            image_format = image.format
+            image.verify()
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail="Image has too many pixels.")
+    except (OSError, SyntaxError, ValueError):
+        raise HTTPException(status_code=415, detail="Only JPEG, PNG, WebP and GIF images are supported.")
+    return IMAGE_TYPES[image_format]
+
+
+def _commit(tmp_path: str, digest: str):
+    """Check a fully written temp file is an image and move it into place, unless identical content is already stored."""
+    media_type = _detect_type(tmp_path)
+    final_path = path_for(digest)
+    if os.path.exists(final_path):
+        os.remove(tmp_path)
+        return media_type
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    with open(_meta_path(digest), "w") as f:
+        json.dump({"content_type": media_type}, f)
+    os.replace(tmp_path, final_path)
+    return media_type
+
+
+def _open_temp():
+    tmp_dir = os.path.join(BLOB_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    return os.fdopen(fd, "wb"), tmp_path
+
+
+async def save_upload(upload) -> tuple[str, int, str]:
+    """Stream an UploadFile into the store chunk by chunk. Returns (digest, size, detected media type)."""
+    sha256, size = hashlib.sha256(), 0
+    f, tmp_path = await run_in_threadpool(_open_temp)
+    try:
+        while chunk := await upload.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_IMAGE_BYTES:
+                raise HTTPException(status_code=413, detail=f"Image larger than {MAX_IMAGE_BYTES} bytes.")
+            sha256.update(chunk)
+            await run_in_threadpool(f.write, chunk)
+        f.close()
+        digest = sha256.hexdigest()
+        media_type = await run_in_threadpool(_commit, tmp_path, digest)
+    except BaseException:
+        f.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest, size, media_type
+
+
+def save_bytes(data: bytes) -> str:
+    """Store an in-memory image (e.g. a decoded data URI), checked like an upload. Returns its digest."""
+    digest = hashlib.sha256(data).hexdigest()
+    f, tmp_path = _open_temp()
+    try:
+        with f:
+            f.write(data)
+        _commit(tmp_path, digest)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest
+
+
+def decode_data_uri(value: str):
+    """The bytes of a base64 image data URI, or None if value isn't one. The declared type is ignored."""
+    match = _DATA_URI.match(value)
+    if not match:
+        return None
+    try:
+        return base64.b64decode(match["data"], validate=True)
+    except binascii.Error:
+        raise HTTPException(status_code=400, detail="Invalid base64 image data.")
+
+
+def _thumbnail_path(digest: str, size: int) -> str:
+    return os.path.join(BLOB_DIR, "thumbnails", str(size), digest[:2], f"{digest}.jpg")
+
+
+def _make_thumbnail(digest: str, size: int) -> str:
+    from PIL import Image  # Optional dependency, only needed for thumbnails
+
+    path = _thumbnail_path(digest, size)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with _open_image(path_for(digest)) as image:
+                image.thumbnail((size, size))
+                f, tmp_path = _open_temp()
+                with f:
+                    image.convert("RGB").save(f, "JPEG", quality=80)
+                os.replace(tmp_path, path)
+        except Image.DecompressionBombError:
+            raise HTTPException(status_code=413, detail="Stored image has too many pixels to thumbnail.")
+    return path
+
+
+async def thumbnail(digest: str, size: int) -> str:
+    """Path to a JPEG thumbnail no larger than size x size, generated on first request."""
+    try:
+        return await run_in_threadpool(_make_thumbnail, digest, size)
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Thumbnails require Pillow to be installed.")
+    except OSError:
+        raise HTTPException(status_code=415, detail="Stored image could not be decoded.")
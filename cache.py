@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import date
+
+# Optional shared cache, e.g. redis://localhost:6379/0; the in-process backend is used when unset
+CACHE_URL = os.getenv("CACHE_URL")
+# Most entries the in-process backend holds; past it the least recently used go first
+LOCAL_CACHE_SIZE = int(os.getenv("LOCAL_CACHE_SIZE", "50000"))
+
+
+class LocalBackend:
+    """
+    In-process key/value store with absolute expiry times, bounded as an LRU:
+    expired entries are only dropped when read, so keys nobody reads again
+    (e.g. version stamps of old requests) are evicted by the size cap instead.
+    """
+
+    def __init__(self, capacity: int = LOCAL_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.time():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def get_many(self, keys: list[str]) -> list:
+        return [await self.get(key) for key in keys]
+
+    def _put(self, key: str, value, expires_at: float):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    async def set(self, key: str, value, expires_at: float):
+        self._put(key, value, expires_at)
+
+    async def add(self, key: str, value, expires_at: float):
+        """Set key unless it already has a value. Returns the value it ends up with."""
+        current = await self.get(key)
+        if current is not None:
+            return current
+        self._put(key, value, expires_at)
+        return value
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+
+class RedisBackend:
+    """Shared backend so every worker sees the same entries and invalidations."""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis  # Optional dependency, only needed when CACHE_URL is set
+
+        self._client = redis.from_url(url)
+
+    async def get(self, key: str):
+        value = await self._client.get(key)
+        return None if value is None else json.loads(value)
+
+    async def get_many(self, keys: list[str]) -> list:
+        return [None if value is None else json.loads(value) for value in await self._client.mget(keys)]
+
+    async def set(self, key: str, value, expires_at: float):
+        ttl = int(expires_at - time.time())
+        if ttl > 0:
+            await self._client.set(key, json.dumps(value), ex=ttl)
+
+    async def add(self, key: str, value, expires_at: float):
+        """Set key unless it already has a value. Returns the value it ends up with."""
+        ttl = max(int(expires_at - time.time()), 1)
+        if await self._client.set(key, json.dumps(value), ex=ttl, nx=True):
+            return value
+        current = await self.get(key)
+        return value if current is None else current
+
+    async def delete(self, key: str):
+        await self._client.delete(key)
+
+
+class ReadThroughCache:
+    """
+    Read-through cache of JSON-serialisable values.
+    Concurrent misses for the same key share one load, and a load that raced
+    with an invalidation is returned but not stored.
+    """
+
+    def __init__(self, backend, prefix: str):
+        self.backend = backend
+        self.prefix = prefix
+        self._locks = {}
+        self._generations = {}
+
+    def _key(self, parts) -> str:
+        return ":".join([self.prefix, *(str(part) for part in parts)])
+
+    async def get_or_load(self, parts, loader, expires_at: float):
+        key = self._key(parts)
+        value = await self.backend.get(key)
+        if value is not None:
+            return value
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            value = await self.backend.get(key)
+            if value is not None:
+                return value
+            generation = self._generations.get(key, 0)
+            value = await loader()
+            if self._generations.get(key, 0) == generation:
+                await self.backend.set(key, value, expires_at)
+            return value
+
+    async def invalidate(self, parts):
+        key = self._key(parts)
+        self._generations[key] = self._generations.get(key, 0) + 1
+        await self.backend.delete(key)
+
+
+backend = RedisBackend(CACHE_URL) if CACHE_URL else LocalBackend()
+
+# Today's requirements per (date, meal_type) as encoded JSON text; entries expire when the meal window ends
+requirements_cache = ReadThroughCache(backend, "requirements:today:json")
+
+
+async def invalidate_requirements(day: date, meal_type: str):
+    await requirements_cache.invalidate((day.isoformat(), meal_type))
@@ -1,4 +1,6 @@
 from database import engine, Base
+import models  # noqa: F401
+import search  # noqa: F401  Adds the full-text index when food_items is created
 
 # Create tables in the MySQL database
 Base.metadata.create_all(bind=engine)
@@ -1,30 +1,40 @@
 from fastapi import HTTPException
 from models import User
+from sqlalchemy import case, func, select, tuple_, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, joinedload
+from starlette.concurrency import run_in_threadpool
 import models, schemas
 import uuid
 from models import CommunityCentre
 from schemas import CommunityCentreCreate
-from passlib.context import CryptContext
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def hash_password(password: str) -> str:
-    """Hashes a plain text password."""
-    return pwd_context.hash(password)
-
-def create_community_centre(db: Session, centre: CommunityCentreCreate):
+import blobstore
+import loaders
+import meals
+import stats
+import versions
+from cache import invalidate_requirements
+from events import publish_food_item, publish_requirement
+from matching import CLOSED_REQUIREMENT_STATUSES, requirement_matcher
+from pagination import decode_cursor, encode_cursor, paginate, paginate_rows
+from passwords import hash_password
+from serialization import projection, shape
+from spatial import centre_index
+from tokens import MANUAL_REASON_PREFIX, TOKENS_PER_SERVING, leaderboard, token_writer
+
+async def create_community_centre(db: AsyncSession, centre: CommunityCentreCreate):
     # Check if email or contact already exists
-    existing_centre = db.query(CommunityCentre).filter(
+    existing_centre = await db.scalar(select(CommunityCentre).filter(
         (CommunityCentre.email == centre.email) | (CommunityCentre.contact == centre.contact)
-    ).first()
+    ).limit(1))
     if existing_centre:
         raise HTTPException(status_code=400, detail="Email or Contact already in use.")
 
     # Hash the password before storing
-    hashed_password = hash_password(centre.password)
-    print(hashed_password)
+    hashed_password = await hash_password(centre.password)
     new_centre = CommunityCentre(
         name=centre.name,
         address=centre.address,
@@ -36,25 +46,64 @@ def create_community_centre(db: Session, centre: CommunityCentreCreate):
     )
 
     db.add(new_centre)
-    db.commit()
-    db.refresh(new_centre)
+    await db.commit()
+    await db.refresh(new_centre)
+    await versions.bump(versions.COMMUNITY_CENTRES)
+    if not centre_index.is_stale():
+        centre_index.insert(new_centre.id, new_centre.latitude, new_centre.longitude)
     return new_centre
 
 
 
-# ✅ Get all community centres
-def get_community_centres(db: Session):
-    return db.query(models.CommunityCentre).all()
+# ✅ Get community centres, one keyset page at a time
+async def get_community_centres(db: AsyncSession, limit: int, cursor: str = None):
+    return await paginate(db, select(models.CommunityCentre), models.CommunityCentre.id, limit, cursor)
 
+# Same page as plain dicts, selecting only the response's columns (see serialization.py)
+async def get_community_centre_rows(db: AsyncSession, limit: int, cursor: str = None):
+    centres = models.CommunityCentre.__table__
+    stmt = select(*projection(schemas.CommunityCentreResponse, centres))
+    rows, next_cursor = await paginate_rows(db, stmt, centres.c.id, limit, cursor)
+    return [shape(schemas.CommunityCentreResponse, row) for row in rows], next_cursor
 
-# ✅ Get a community centre by ID
-def get_community_centre_by_id(db: Session, centre_id: str):
-    return db.query(models.CommunityCentre).filter(models.CommunityCentre.id == centre_id).first()
+
+# ✅ Get the community centres closest to a point, using the in-memory spatial index
+async def get_nearby_community_centres(db: AsyncSession, latitude: float, longitude: float, k: int, radius_km: float = None):
+    if centre_index.is_stale():
+        centre_index.load(
+            (await db.execute(select(CommunityCentre.id, CommunityCentre.latitude, CommunityCentre.longitude))).all()
+        )
+
+    hits = centre_index.nearest(latitude, longitude, k, max_radius_km=radius_km)
+    if not hits:
+        return []
+
+    centres = await db.scalars(
+        select(CommunityCentre).filter(CommunityCentre.id.in_([centre_id for _, centre_id in hits]))
+    )
+    by_id = {centre.id: centre for centre in centres}
+    return [
+        (by_id[centre_id], distance)
+        for distance, centre_id in hits
+        if centre_id in by_id
+    ]
+
+
+# ✅ Get a community centre by ID; lookups made together in one request share a query
+async def get_community_centre_by_id(db: AsyncSession, centre_id: str):
+    return await loaders.loader(db, models.CommunityCentre).load(centre_id)
+
+async def get_community_centres_by_ids(db: AsyncSession, centre_ids: list[str]):
+    """The centres with these ids, in the same order; unknown ids are skipped."""
+    return [centre for centre in await loaders.loader(db, models.CommunityCentre).load_many(centre_ids) if centre]
+
+async def get_community_centre_by_email(db: AsyncSession, email: str):
+    return await db.scalar(select(CommunityCentre).filter(CommunityCentre.email == email).limit(1))
 
 #End user endpoints
-def create_user(db: Session, user: schemas.UserCreate):
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
     try:
-        hashed_password = pwd_context.hash(user.password)
+        hashed_password = await hash_password(user.password)
         db_user = User(
             name=user.name,
             address=user.address,
@@ -64,141 +113,495 @@ def create_user(db: Session, user: schemas.UserCreate):
             token_count=0
         )
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
         return db_user
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail="Email or Contact already exists")
 
-def get_user_by_id(db: Session, user_id: str):
-    return db.query(User).filter(User.id == user_id).first()
+async def update_password_hash(db: AsyncSession, account, new_hash: str):
+    """Store an upgraded hash for a user or community centre after a successful login."""
+    account.password = new_hash
+    await db.commit()
+
+async def get_user_by_id(db: AsyncSession, user_id: str):
+    return await loaders.loader(db, User).load(user_id)
 
-def get_all_users(db: Session):
-    return db.query(User).all()
+async def get_users_by_ids(db: AsyncSession, user_ids: list[str]):
+    """The users with these ids, in the same order; unknown ids are skipped."""
+    return [user for user in await loaders.loader(db, User).load_many(user_ids) if user]
 
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(select(User).filter(User.email == email).limit(1))
 
-def get_requirement_by_id(db: Session, requirement_id: str):
-    return db.query(models.Requirement).filter(models.Requirement.id == requirement_id).first()
+async def get_all_users(db: AsyncSession, limit: int, cursor: str = None):
+    return await paginate(db, select(User), User.id, limit, cursor)
+
+
+def requirement_loader(db: AsyncSession):
+    return loaders.loader(db, models.Requirement, eager=(models.Requirement.community_centre,))
+
+async def get_requirement_by_id(db: AsyncSession, requirement_id: str):
+    return await requirement_loader(db).load(requirement_id)
+
+async def get_requirements_by_ids(db: AsyncSession, requirement_ids: list[str]):
+    """The requirements with these ids and their centres, in the same order; unknown ids are skipped."""
+    return [requirement for requirement in await requirement_loader(db).load_many(requirement_ids) if requirement]
 
-from sqlalchemy.orm import Session
 from models import Requirement
-from datetime import date
+from datetime import date, datetime
 
-def get_requirements_by_date_and_meal_type(db: Session, today_date: date, meal_type: str):
+async def get_requirements_by_date_and_meal_type(db: AsyncSession, today_date: date, meal_type: str):
     """Fetch all community centre requirements for the current date and meal type."""
-    return db.query(Requirement).filter(
+    return (await db.scalars(select(Requirement).options(joinedload(Requirement.community_centre)).filter(
         Requirement.date == today_date,
         Requirement.meal_type == meal_type
-    ).all()
+    ))).all()
 
-def get_requirements(db: Session):
-    return db.query(models.Requirement).join(models.CommunityCentre).all()
+def requirements_with_centres():
+    return (
+        select(models.Requirement)
+        .join(models.Requirement.community_centre)
+        .options(contains_eager(models.Requirement.community_centre))
+    )
 
-def create_or_update_requirement(db: Session, requirement: schemas.RequirementCreate):
-    existing_requirement = (
-        db.query(models.Requirement)
-        .filter(
-            models.Requirement.date == requirement.date,
-            models.Requirement.community_centre_id == requirement.community_centre_id,
-            models.Requirement.meal_type == requirement.meal_type
+async def get_requirements(db: AsyncSession, limit: int, cursor: str = None):
+    return await paginate(db, requirements_with_centres(), models.Requirement.id, limit, cursor)
+
+async def get_requirement_rows(db: AsyncSession, limit: int, cursor: str = None):
+    """get_requirements as plain dicts, with each centre nested from the same row."""
+    requirements, centres = models.Requirement.__table__, models.CommunityCentre.__table__
+    stmt = (
+        select(
+            *projection(schemas.RequirementResponse, requirements),
+            *projection(schemas.CommunityCentreResponse, centres, prefix="community_centre"),
         )
-        .first()
+        .join(centres, requirements.c.community_centre_id == centres.c.id)
     )
-
-    if existing_requirement:
-        # Update existing record
-        existing_requirement.servings = requirement.servings
-        existing_requirement.status = requirement.status
-        db.commit()
-        db.refresh(existing_requirement)
-        return existing_requirement
-    else:
-        # Create a new requirement
-        new_requirement = models.Requirement(
-            id=str(uuid.uuid4()),
-            community_centre_id=requirement.community_centre_id,
-            servings=requirement.servings,
-            date=requirement.date,
-            meal_type=requirement.meal_type,
-            status=requirement.status
+    rows, next_cursor = await paginate_rows(db, stmt, requirements.c.id, limit, cursor)
+    return [shape(schemas.RequirementResponse, row) for row in rows], next_cursor
+
+
+# ✅ Rank today's open requirements for a donor, using the in-memory matcher
+async def match_requirements(db: AsyncSession, latitude: float, longitude: float, servings: int, at: datetime, k: int):
+    slot = meals.current_meal_slot(at)
+    if requirement_matcher.is_stale(slot):
+        day, meal_type = slot
+        requirement_matcher.load(slot, (await db.execute(
+            select(Requirement.id, Requirement.community_centre_id, Requirement.servings,
+                   CommunityCentre.latitude, CommunityCentre.longitude)
+            .join(Requirement.community_centre)
+            .filter(
+                Requirement.date == day,
+                Requirement.meal_type == meal_type,
+                Requirement.servings > 0,
+                Requirement.status.not_in(CLOSED_REQUIREMENT_STATUSES),
+            )
+        )).all())
+
+    matches = requirement_matcher.match(latitude, longitude, servings, at, meals.meal_window_end(at), k)
+    if not matches:
+        return []
+
+    requirements = await db.scalars(
+        select(Requirement)
+        .options(joinedload(Requirement.community_centre))
+        .filter(Requirement.id.in_([requirement_id for _, _, requirement_id, _ in matches]))
+    )
+    by_id = {requirement.id: requirement for requirement in requirements}
+    return [
+        (score, distance, by_id[requirement_id])
+        for score, distance, requirement_id, _ in matches
+        if requirement_id in by_id
+    ]
+
+def upsert_requirements_statement(dialect_name: str, rows: list[dict]):
+    """
+    Build a single INSERT ... ON DUPLICATE KEY UPDATE (MySQL) / ON CONFLICT DO UPDATE (SQLite)
+    over the (community_centre_id, date, meal_type) unique index.
+    Existing rows keep their id and get the new servings and status.
+    """
+    table = models.Requirement.__table__
+    if dialect_name == "mysql":
+        stmt = mysql_insert(table).values(rows)
+        return stmt.on_duplicate_key_update(servings=stmt.inserted.servings, status=stmt.inserted.status)
+    if dialect_name == "sqlite":
+        stmt = sqlite_insert(table).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.community_centre_id, table.c.date, table.c.meal_type],
+            set_={"servings": stmt.excluded.servings, "status": stmt.excluded.status},
+        )
+    raise NotImplementedError(f"No requirement upsert for dialect {dialect_name!r}")
+
+async def create_or_update_requirement(db: AsyncSession, requirement: schemas.RequirementCreate, before_commit=None):
+    """Upsert one requirement. before_commit(db, saved), if given, runs inside the transaction (see idempotency.py)."""
+    # Checked up front: SQLite doesn't enforce the foreign key, so the IntegrityError below can't be relied on
+    if not await db.scalar(select(CommunityCentre.id).filter(CommunityCentre.id == requirement.community_centre_id)):
+        raise HTTPException(status_code=400, detail="Invalid community_centre_id: Community centre does not exist.")
+
+    stmt = upsert_requirements_statement(db.get_bind().dialect.name, [{
+        "id": str(uuid.uuid4()),
+        "community_centre_id": requirement.community_centre_id,
+        "servings": requirement.servings,
+        "date": requirement.date,
+        "meal_type": requirement.meal_type,
+        "status": requirement.status,
+    }])
+    try:
+        await db.execute(stmt)
+        await stats.refresh_requirement_totals(db, [(requirement.community_centre_id, requirement.date)])
+        saved = await db.scalar(
+            select(models.Requirement)
+            .options(joinedload(models.Requirement.community_centre))
+            .filter(
+                models.Requirement.community_centre_id == requirement.community_centre_id,
+                models.Requirement.date == requirement.date,
+                models.Requirement.meal_type == requirement.meal_type
+            )
+            .execution_options(populate_existing=True)
         )
-        db.add(new_requirement)
-        db.commit()
-        db.refresh(new_requirement)
-        return new_requirement
+        if before_commit:
+            await before_commit(db, saved)
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Invalid community_centre_id: Community centre does not exist.")
+    await invalidate_requirements(requirement.date, requirement.meal_type)
+    await versions.requirements_changed([(requirement.community_centre_id, requirement.date, requirement.meal_type)])
+
+    publish_requirement(saved)
+    requirement_matcher.apply(saved)
+    return saved
 
-from datetime import datetime
+# Rows per INSERT statement in batch upserts, to stay under driver/SQLite parameter limits
+UPSERT_CHUNK_SIZE = 500
 
-def get_requests_by_community_centre(db: Session, community_centre_id: str):
+async def create_or_update_requirements(db: AsyncSession, requirements: list[schemas.RequirementCreate]):
     """
-    Get requests for a given community centre, sorted by earliest date first.
-    Determines the meal type automatically based on the current time.
+    Upsert many requirements in one transaction with bulk upsert statements.
+    Returns one result dict per input item, in order. Items for unknown centres
+    are reported as errors and skipped; when the same slot appears more than
+    once, the last item wins.
+    """
+    def natural_key(item):
+        return (item.community_centre_id, item.date, item.meal_type)
+
+    def chunked_key_filters(keys):
+        """Conditions matching exactly these (centre, date, meal) keys, a chunk at a time."""
+        keys = list(keys)
+        natural_columns = tuple_(
+            models.Requirement.community_centre_id, models.Requirement.date, models.Requirement.meal_type
+        )
+        for start in range(0, len(keys), UPSERT_CHUNK_SIZE):
+            yield natural_columns.in_(keys[start:start + UPSERT_CHUNK_SIZE])
+
+    centre_ids = {item.community_centre_id for item in requirements}
+    known_centres = set((await db.scalars(
+        select(CommunityCentre.id).filter(CommunityCentre.id.in_(centre_ids))
+    )).all())
+
+    # Which slots already exist, so each item can be reported as created or updated
+    existing_keys = set()
+    for key_filter in chunked_key_filters({natural_key(item) for item in requirements}):
+        existing_keys.update((await db.execute(
+            select(models.Requirement.community_centre_id, models.Requirement.date, models.Requirement.meal_type)
+            .filter(key_filter)
+        )).tuples())
+
+    rows = {}
+    for item in requirements:
+        if item.community_centre_id in known_centres:
+            rows[natural_key(item)] = {"id": str(uuid.uuid4()), **item.model_dump()}
+
+    dialect_name = db.get_bind().dialect.name
+    values = list(rows.values())
+    for start in range(0, len(values), UPSERT_CHUNK_SIZE):
+        await db.execute(upsert_requirements_statement(dialect_name, values[start:start + UPSERT_CHUNK_SIZE]))
+    await stats.refresh_requirement_totals(db, [(centre_id, day) for centre_id, day, _ in rows])
+    await db.commit()
+    for day, meal_type in {(day, meal_type) for _, day, meal_type in rows}:
+        await invalidate_requirements(day, meal_type)
+    await versions.requirements_changed(rows)
+
+    # Read back just the upserted slots
+    saved = {}
+    for key_filter in chunked_key_filters(rows):
+        for requirement in (await db.scalars(
+            select(models.Requirement)
+            .options(joinedload(models.Requirement.community_centre))
+            .filter(key_filter)
+            .execution_options(populate_existing=True)
+        )).all():
+            saved[(requirement.community_centre_id, requirement.date, requirement.meal_type)] = requirement
+            publish_requirement(requirement)
+            requirement_matcher.apply(requirement)
+
+    results = []
+    for index, item in enumerate(requirements):
+        key = natural_key(item)
+        if item.community_centre_id not in known_centres:
+            results.append({"index": index, "status": "error", "error": "Community centre does not exist."})
+        else:
+            status = "updated" if key in existing_keys else "created"
+            results.append({"index": index, "status": status, "requirement": saved[key]})
+    return results
+
+async def get_requests_by_community_centre(db: AsyncSession, community_centre_id: str, limit: int, cursor: str = None):
     """
-    meal_priority = {"breakfast": 1, "lunch": 2, "dinner": 3}
+    Get a centre's requests from the current meal window onwards, earliest date
+    and meal first, one page at a time. Returns (requirements, next_cursor).
+    """
+    today, meal_type = meals.current_meal_slot()
+    rank = meals.meal_order(models.Requirement.meal_type)
+    query = (
+        select(models.Requirement)
+        .options(joinedload(models.Requirement.community_centre))
+        .filter(
+            models.Requirement.community_centre_id == community_centre_id,
+            models.Requirement.date >= today,
+            (models.Requirement.date > today) | (rank >= meals.MEAL_ORDER[meal_type]),
+        )
+    )
 
-    # Determine the meal type based on the current time
-    current_hour = datetime.now().hour
+    # A centre has one requirement per (date, meal), so that pair is the keyset
+    if cursor:
+        try:
+            after_date, after_rank = decode_cursor(cursor)
+            after_date = date.fromisoformat(after_date)
+            if not isinstance(after_rank, int):
+                raise TypeError(after_rank)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(
+            (models.Requirement.date > after_date) | ((models.Requirement.date == after_date) & (rank > after_rank))
+        )
 
-    if current_hour < 10:
-        meal_type = "breakfast"
-    elif current_hour < 16:
-        meal_type = "lunch"
-    else:
-        meal_type = "dinner"
-    print(f"Current meal type: {meal_type}")
+    results = (await db.scalars(query.order_by(models.Requirement.date, rank).limit(limit + 1))).all()
+    if len(results) > limit:
+        last = results[limit - 1]
+        return results[:limit], encode_cursor([last.date.isoformat(), meals.MEAL_ORDER.get(last.meal_type, len(meals.MEAL_ORDER))])
+    return results, None
 
-    # Filter requests for the given community center
-    query = db.query(models.Requirement).filter(models.Requirement.community_centre_id == community_centre_id)
 
-    # Exclude earlier meal types based on time
-    if meal_type == "lunch":
-        query = query.filter(models.Requirement.meal_type != "breakfast")
-    elif meal_type == "dinner":
-        query = query.filter(models.Requirement.meal_type != "breakfast", models.Requirement.meal_type != "lunch")
+async def store_food_item_image(image: str) -> str:
+    """
+    Resolve FoodItemCreate.image to what we keep in the row: uploaded image refs
+    are checked, base64 data URIs from older clients are moved into the blob store.
+    """
+    data = blobstore.decode_data_uri(image)
+    if data is not None:
+        if len(data) > blobstore.MAX_IMAGE_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image larger than {blobstore.MAX_IMAGE_BYTES} bytes.")
+        return blobstore.image_ref(await run_in_threadpool(blobstore.save_bytes, data))
+
+    if image.startswith(blobstore.IMAGE_REF_PREFIX):
+        if not blobstore.exists(image[len(blobstore.IMAGE_REF_PREFIX):]):
+            raise HTTPException(status_code=400, detail="Invalid image: upload it to /images first.")
+    elif len(image) > models.FoodItem.image.type.length:
+        raise HTTPException(status_code=400, detail="Invalid image: upload it to /images first.")
+    return image
+
+async def create_food_item(db: AsyncSession, food_item: schemas.FoodItemCreate, before_commit=None):
+    """Donate a food item. before_commit(db, food_item), if given, runs inside the transaction (see idempotency.py)."""
+    # Validate that the requirement (request_id) exists
+    requirement = await db.get(Requirement, food_item.request_id)
+    if not requirement:
+        raise HTTPException(status_code=400, detail="Invalid request_id: Requirement does not exist.")
+
+    # Validate that the user exists
+    user = await db.get(User, food_item.user_id)
+    if not user:
+        raise HTTPException(status_code=400, detail="Invalid user_id: User does not exist.")
+
+    # Create the new FoodItem
+    new_food_item = models.FoodItem(
+        id=str(uuid.uuid4()),  # Generate a unique ID
+        image=await store_food_item_image(food_item.image),
+        title=food_item.title,
+        description=food_item.description,
+        servings=food_item.servings,
+        request_id=food_item.request_id,
+        user_id=food_item.user_id,
+        status="Open",  # Default status
+    )
 
-    # Sort first by date (earliest first), then by meal type priority
-    query = query.order_by(models.Requirement.date.asc()).all()
+    db.add(new_food_item)
+    await stats.add_food_item_servings(db, requirement.community_centre_id, requirement.date, {"Open": food_item.servings})
+    if before_commit:
+        await before_commit(db, new_food_item)
+    await db.commit()
+    await db.refresh(new_food_item)
+    await versions.bump(versions.food_items_scope(new_food_item.request_id))
+    publish_food_item("food_item.created", new_food_item, requirement.community_centre_id)
+
+    return new_food_item
+
+
+async def get_food_items_by_request_id(db: AsyncSession, request_id: str):
+    return (await db.scalars(
+        select(models.FoodItem)
+        .options(joinedload(models.FoodItem.user))
+        .filter(models.FoodItem.request_id == request_id)
+    )).all()
+
+async def get_food_item_rows_by_request_id(db: AsyncSession, request_id: str):
+    """get_food_items_by_request_id as plain dicts, with each donor nested from the same row."""
+    food_items, users = models.FoodItem.__table__, models.User.__table__
+    rows = (await db.execute(
+        select(
+            *projection(schemas.FoodItemResponseWithUser, food_items),
+            *projection(schemas.UserResponse, users, prefix="user"),
+        )
+        .join(users, food_items.c.user_id == users.c.id)
+        .filter(food_items.c.request_id == request_id)
+    )).mappings()
+    return [shape(schemas.FoodItemResponseWithUser, row) for row in rows]
 
-    # Sort results based on meal type priority
-    sorted_results = sorted(query, key=lambda r: meal_priority[r.meal_type])
 
-    return sorted_results
+# Allowed food item status changes; "Received" and "Not fulfilled" are final
+FOOD_ITEM_TRANSITIONS = {
+    "Open": {"Approved", "Not fulfilled"},
+    "Approved": {"In Transit", "Received", "Not fulfilled"},
+    "In Transit": {"Received", "Not fulfilled"},
+    "Received": set(),
+    "Not fulfilled": set(),
+}
 
 
-def update_food_item_status(db: Session, food_item_id: str, new_status: str):
+async def update_food_item_status(db: AsyncSession, food_item_id: str, new_status: str):
     # Fetch the food item by ID
-    food_item = db.query(models.FoodItem).filter(models.FoodItem.id == food_item_id).first()
+    food_item = await db.get(models.FoodItem, food_item_id)
 
     # Check if the food item exists
     if not food_item:
         raise HTTPException(status_code=404, detail="Food item not found")
 
     # Validate if the status is valid
-    valid_statuses = ["Open", "Approved", "In Transit", "Received", "Not fulfilled"]
-    if new_status not in valid_statuses:
+    if new_status not in FOOD_ITEM_TRANSITIONS:
         raise HTTPException(status_code=400, detail="Invalid status")
 
-    # Update the status
-    food_item.status = new_status
-    db.commit()
-    db.refresh(food_item)
+    old_status = food_item.status
+    if new_status == old_status:
+        return food_item  # Repeated update, nothing to do
+    if new_status not in FOOD_ITEM_TRANSITIONS[old_status]:
+        raise HTTPException(status_code=409, detail=f"Cannot change status from {old_status} to {new_status}")
+
+    # Compare-and-set on the old status, so two concurrent updates can't both apply
+    result = await db.execute(
+        update(models.FoodItem)
+        .where(models.FoodItem.id == food_item_id, models.FoodItem.status == old_status)
+        .values(status=new_status)
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Food item status was changed by another request, please retry")
 
     if new_status == "Received":
-        requirement = db.query(Requirement).filter(Requirement.id == food_item.request_id).first()
-        if requirement:
-            # Adjust the servings
-            requirement.servings -= food_item.servings
-            if requirement.servings <= 0:
-                requirement.servings = 0  # Ensure it does not go negative
-                requirement.status = "Fulfilled"  # Optional: Mark requirement as fulfilled
-
-            db.commit()
-            db.refresh(requirement)
+        # Decrement in SQL so concurrent deliveries can't overwrite each other's servings.
+        # status is assigned first because MySQL evaluates SET clauses left to right.
+        remaining = Requirement.servings - food_item.servings
+        await db.execute(
+            update(Requirement)
+            .where(Requirement.id == food_item.request_id)
+            .ordered_values(
+                (Requirement.status, case((remaining <= 0, "Fulfilled"), else_=Requirement.status)),
+                (Requirement.servings, case((remaining < 0, 0), else_=remaining)),
+            )
+        )
+        # Awarded through the ledger; tokens.TokenWriter adds it to the donor's balance in a batch
+        db.add(models.TokenLedger(
+            user_id=food_item.user_id,
+            delta=food_item.servings * TOKENS_PER_SERVING,
+            reason="food_item.received",
+            reference_id=food_item.id,
+        ))
+    requirement = await db.scalar(
+        select(Requirement).where(Requirement.id == food_item.request_id).execution_options(populate_existing=True)
+    )
+    await stats.add_food_item_servings(
+        db, requirement.community_centre_id, requirement.date,
+        {old_status: -food_item.servings, new_status: food_item.servings},
+    )
+    if new_status == "Received":
+        await stats.refresh_requirement_totals(db, [(requirement.community_centre_id, requirement.date)])
 
+    await db.commit()
+    food_item.status = new_status
+    await versions.bump(versions.food_items_scope(food_item.request_id))
+    publish_food_item("food_item.status", food_item, requirement.community_centre_id)
+    if new_status == "Received":
+        token_writer.notify()
+        await invalidate_requirements(requirement.date, requirement.meal_type)
+        await versions.requirements_changed([(requirement.community_centre_id, requirement.date, requirement.meal_type)])
+        publish_requirement(requirement)
+        requirement_matcher.apply(requirement)
     return food_item
 
 
+async def get_token_count(db: AsyncSession, user_id: str):
+    return await db.scalar(select(User.token_count).filter(User.id == user_id))
+
 
+async def update_token_count(db: AsyncSession, user_id: str, token_count: int, reference_id: str = None):
+    """Set an absolute balance, recording the difference in the ledger as a manual change by reference_id."""
+    user = await db.scalar(select(User).filter(User.id == user_id).with_for_update())
+    if not user:
+        return None
 
+    db.add(models.TokenLedger(
+        user_id=user_id, delta=token_count - (user.token_count or 0), reason=MANUAL_REASON_PREFIX + "set",
+        reference_id=reference_id, applied=True,
+    ))
+    user.token_count = token_count
+    await db.commit()
+    await db.refresh(user)
+    await versions.bump(versions.TOKEN_COUNTS)
+    leaderboard.update(user.id, user.name, user.token_count)
+    return user
 
+
+async def change_token_count(db: AsyncSession, user_id: str, delta: int, reason: str, reference_id: str = None):
+    """
+    Atomically add delta (negative to spend) to a user's balance and record it in
+    the ledger as a manual change, with reference_id naming who made it.
+    """
+    stmt = update(User).where(User.id == user_id).values(token_count=func.coalesce(User.token_count, 0) + delta)
+    if delta < 0:
+        stmt = stmt.where(func.coalesce(User.token_count, 0) >= -delta)
+    result = await db.execute(stmt)
+    if result.rowcount != 1:
+        await db.rollback()
+        if not await db.get(User, user_id):
+            raise HTTPException(status_code=404, detail="User not found")
+        raise HTTPException(status_code=409, detail="Not enough tokens")
+
+    db.add(models.TokenLedger(
+        user_id=user_id, delta=delta, reason=MANUAL_REASON_PREFIX + reason, reference_id=reference_id, applied=True,
+    ))
+    user = await db.scalar(select(User).filter(User.id == user_id).execution_options(populate_existing=True))
+    await db.commit()
+    await versions.bump(versions.TOKEN_COUNTS)
+    leaderboard.update(user.id, user.name, user.token_count)
+    return user
+
+
+async def get_token_ledger(db: AsyncSession, user_id: str, limit: int):
+    """A user's most recent ledger entries, newest first."""
+    return (await db.scalars(
+        select(models.TokenLedger)
+        .filter(models.TokenLedger.user_id == user_id)
+        .order_by(models.TokenLedger.created_at.desc(), models.TokenLedger.id)
+        .limit(limit)
+    )).all()
+
+
+# ✅ Top users by tokens, from the in-memory leaderboard
+async def get_leaderboard(db: AsyncSession, limit: int):
+    if leaderboard.is_stale():
+        leaderboard.load((await db.execute(
+            select(User.id, User.name, User.token_count)
+            .order_by(User.token_count.desc(), User.id)
+            .limit(leaderboard.size)
+        )).all())
+    return leaderboard.top(limit)
@@ -0,0 +1,115 @@
+import asyncio
+import itertools
+import json
+import os
+
+# Events buffered per subscriber before it is considered too slow and disconnected
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+HEARTBEAT_SECONDS = 15
+
+
+class Subscription:
+    def __init__(self, topics: set[str]):
+        self.topics = topics
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class EventBroker:
+    """
+    In-process fan-out of change events to subscribers.
+    Topics are "centre:<id>" and "request:<id>"; a subscription with no topics
+    receives everything. Publishing never blocks: a subscriber whose queue is
+    full is marked overflowed and dropped, and its stream tells the client to
+    refetch and resubscribe.
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, topics: set[str]) -> Subscription:
+        subscription = Subscription(topics)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscriptions.discard(subscription)
+
+    def publish(self, event_type: str, data: dict, topics: set[str]):
+        event = {"id": next(self._ids), "type": event_type, "data": data}
+        for subscription in list(self._subscriptions):
+            if subscription.topics and not subscription.topics & topics:
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
+
+
+broker = EventBroker()
+
+
+def _format(event_type: str, data, event_id=None) -> str:
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines += [f"event: {event_type}", f"data: {json.dumps(data, default=str)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream(request, subscription: Subscription):
+    """Server-sent events for one subscription, until the client disconnects or falls behind."""
+    try:
+        yield _format("ready", {"topics": sorted(subscription.topics)})
+        while not subscription.overflowed:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keep-alive\n\n"
+                continue
+            yield _format(event["type"], event["data"], event["id"])
+
+        if subscription.overflowed:
+            yield _format("overflow", {"detail": "Too many pending events; refetch and reconnect."})
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def requirement_event(requirement) -> dict:
+    return {
+        "id": requirement.id,
+        "community_centre_id": requirement.community_centre_id,
+        "date": requirement.date.isoformat(),
+        "meal_type": requirement.meal_type,
+        "servings": requirement.servings,
+        "status": requirement.status,
+    }
+
+
+def food_item_event(food_item) -> dict:
+    return {
+        "id": food_item.id,
+        "request_id": food_item.request_id,
+        "user_id": food_item.user_id,
+        "title": food_item.title,
+        "servings": food_item.servings,
+        "status": food_item.status,
+    }
+
+
+def publish_requirement(requirement):
+    broker.publish(
+        "requirement.updated",
+        requirement_event(requirement),
+        {f"centre:{requirement.community_centre_id}", f"request:{requirement.id}"},
+    )
+
+
+def publish_food_item(event_type: str, food_item, community_centre_id: str):
+    broker.publish(
+        event_type,
+        food_item_event(food_item),
+        {f"centre:{community_centre_id}", f"request:{food_item.request_id}"},
+    )
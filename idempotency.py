@@ -0,0 +1,251 @@
+"""
+Idempotency-Key support for create endpoints.
+
+A client that retries a POST with the same Idempotency-Key gets the response
+of the first attempt back instead of a second write. Completed responses are
+kept in a per-process LRU, so most retries cost a dictionary lookup; the
+idempotency_keys table makes a key good across workers and restarts, and a
+row with no status yet marks a request that is still running. Duplicates that
+arrive while the first request is running in this process wait for its
+result; ones that land on another worker get a 409 and can retry.
+
+The claim row is written before the endpoint runs. The endpoint writes its
+response into that row in the same transaction as the change it makes, so a
+committed change always has a replayable response; a worker that dies before
+committing leaves only an unfinished claim, which is taken over once it is
+IDEMPOTENCY_LOCK_SECONDS old. A takeover makes the original request's commit
+fail with a 409 rather than write twice.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+import database
+import models
+
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# How long an unfinished claim blocks other workers before it is treated as abandoned
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def request_hash(payload) -> str:
+    """Fingerprint of a request body, independent of key order."""
+    return _sha256(json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str))
+
+
+class StoredResponse:
+    def __init__(self, request_hash: str, status_code: int, body, expires_at: float):
+        self.request_hash = request_hash
+        self.status_code = status_code
+        self.body = body
+        self.expires_at = expires_at  # Unix time
+
+
+class _ClaimLost(Exception):
+    """The claim was taken over by another request before this one could commit."""
+
+
+class ResponseCache:
+    """LRU of completed responses by key hash; entries also lapse after the TTL."""
+
+    def __init__(self, capacity: int = IDEMPOTENCY_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+
+    def get(self, key_hash: str):
+        stored = self._entries.get(key_hash)
+        if stored is None:
+            return None
+        if stored.expires_at <= time.time():
+            del self._entries[key_hash]
+            return None
+        self._entries.move_to_end(key_hash)
+        return stored
+
+    def put(self, key_hash: str, stored: StoredResponse):
+        self._entries[key_hash] = stored
+        self._entries.move_to_end(key_hash)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+
+class IdempotencyStore:
+    def __init__(self, ttl_seconds: int = IDEMPOTENCY_TTL, lock_seconds: int = IDEMPOTENCY_LOCK_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.cache = ResponseCache()
+        self._in_flight = {}  # key hash -> future resolving to the StoredResponse
+
+    async def run(self, scope: str, key: str, payload, handler, schema) -> JSONResponse:
+        """
+        Run handler(record) once per (scope, key) and return its response as
+        JSON, serialised with schema. The handler must await record(db, result)
+        on its session just before committing, so the response is stored in the
+        same transaction. Later calls with the same key replay that response;
+        reusing a key for a different payload is a 422. HTTPExceptions from the
+        handler are stored and replayed like any other response. Other errors
+        release the key so the request can be retried.
+        """
+        key_hash = _sha256(f"{scope}\n{key}")
+        fingerprint = request_hash(payload)
+
+        stored = self.cache.get(key_hash)
+        if stored is None and key_hash in self._in_flight:
+            stored = await asyncio.shield(self._in_flight[key_hash])
+        if stored is not None:
+            return self._replay(stored, fingerprint)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key_hash] = future
+        claimed_at = None
+        try:
+            stored, claimed_at = await self._claim(key_hash, fingerprint)
+            if stored is not None:
+                future.set_result(stored)
+                return self._replay(stored, fingerprint)
+
+            recorded = []
+
+            async def record(db, result):
+                body = schema.model_validate(result, from_attributes=True).model_dump(mode="json")
+                await self._complete(db, key_hash, claimed_at, 200, body)
+                recorded.append(body)
+
+            try:
+                await handler(record)
+                if not recorded:
+                    raise RuntimeError(f"Idempotent handler for {scope} didn't record its response")
+                status_code, body = 200, recorded[0]
+            except HTTPException as exc:
+                if exc.status_code >= 500 or recorded:
+                    raise
+                status_code, body = exc.status_code, {"detail": exc.detail}
+                async with database.AsyncSessionLocal() as db:
+                    await self._complete(db, key_hash, claimed_at, status_code, body)
+                    await db.commit()
+
+            stored = StoredResponse(fingerprint, status_code, body, time.time() + self.ttl_seconds)
+            self.cache.put(key_hash, stored)
+            future.set_result(stored)
+            return JSONResponse(body, status_code=status_code)
+        except _ClaimLost:
+            exc = HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+            future.set_exception(exc)
+            future.exception()
+            raise exc
+        except BaseException as exc:
+            if claimed_at is not None and not future.done():
+                await self._release(key_hash, claimed_at)
+            if not future.done():
+                if isinstance(exc, Exception):
+                    future.set_exception(exc)
+                    future.exception()  # Waiters re-raise it; don't warn when there are none
+                else:
+                    future.cancel()
+            raise
+        finally:
+            del self._in_flight[key_hash]
+
+    def _replay(self, stored: StoredResponse, fingerprint: str) -> JSONResponse:
+        if stored.request_hash != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        return JSONResponse(stored.body, status_code=stored.status_code, headers={REPLAYED_HEADER: "true"})
+
+    async def _claim(self, key_hash: str, fingerprint: str):
+        """
+        Claim the key for this request. Returns (None, claim time) when claimed, or
+        (stored response, None) if the key has already completed. 409 while another worker has it.
+        """
+        table = models.IdempotencyKey
+        now = datetime.utcnow()
+        async with database.AsyncSessionLocal() as db:
+            db.add(table(
+                key_hash=key_hash, request_hash=fingerprint,
+                created_at=now, expires_at=now + timedelta(seconds=self.ttl_seconds),
+            ))
+            try:
+                await db.commit()
+                return None, now
+            except IntegrityError:
+                await db.rollback()
+
+            row = await db.get(table, key_hash)
+            if row is None:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+            if row.status_code is not None and row.expires_at > now:
+                stored = StoredResponse(
+                    row.request_hash, row.status_code, json.loads(row.response_body),
+                    time.time() + (row.expires_at - now).total_seconds(),
+                )
+                self.cache.put(key_hash, stored)
+                return stored, None
+
+            # Expired, or an abandoned claim: take it over, unless another request beats us to it
+            abandoned = now - timedelta(seconds=self.lock_seconds)
+            taken = await db.execute(
+                update(table)
+                .where(
+                    table.key_hash == key_hash,
+                    table.created_at == row.created_at,
+                    (table.expires_at <= now) | ((table.status_code == None) & (table.created_at <= abandoned)),  # noqa: E711
+                )
+                .values(
+                    request_hash=fingerprint, status_code=None, response_body=None,
+                    created_at=now, expires_at=now + timedelta(seconds=self.ttl_seconds),
+                )
+            )
+            await db.commit()
+            if taken.rowcount != 1:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+            return None, now
+
+    @staticmethod
+    def _ours(key_hash: str, claimed_at: datetime):
+        """Condition matching the key's row only while it is still this request's unfinished claim."""
+        table = models.IdempotencyKey
+        return (table.key_hash == key_hash) & (table.created_at == claimed_at) & (table.status_code == None)  # noqa: E711
+
+    async def _complete(self, db, key_hash: str, claimed_at: datetime, status_code: int, body):
+        """Store the response through db, uncommitted. _ClaimLost if another request took the key over."""
+        table = models.IdempotencyKey
+        written = await db.execute(
+            update(table).where(self._ours(key_hash, claimed_at))
+            .values(status_code=status_code, response_body=json.dumps(body))
+        )
+        if written.rowcount != 1:
+            raise _ClaimLost(key_hash)
+
+    async def _release(self, key_hash: str, claimed_at: datetime):
+        table = models.IdempotencyKey
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(delete(table).where(self._ours(key_hash, claimed_at)))
+            await db.commit()
+
+
+async def purge_expired(now: datetime = None) -> int:
+    """Delete stored responses past their TTL. Returns how many were removed."""
+    table = models.IdempotencyKey
+    async with database.AsyncSessionLocal() as db:
+        result = await db.execute(delete(table).where(table.expires_at <= (now or datetime.utcnow())))
+        await db.commit()
+    return result.rowcount
+
+
+# Shared per-process store; in-flight coalescing only works within one process
+idempotency_store = IdempotencyStore()
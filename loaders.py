@@ -0,0 +1,116 @@
+"""
+Request-scoped batching of lookups by primary key.
+
+Single-row lookups made while serving one request (e.g. several
+get_user_by_id calls under asyncio.gather) are queued for one turn of the
+event loop and then fetched together with one IN query per model. Rows the
+request's session already holds are returned without a query. Outside
+request_scope(), every lookup is its own batch.
+"""
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import Session, joinedload
+
+# Most ids accepted by the ?ids= batch endpoints
+BATCH_ID_LIMIT = 1000
+# Ids per IN query, to stay under driver/SQLite parameter limits
+ID_CHUNK_SIZE = 500
+
+_loaders = ContextVar("loaders", default=None)
+
+
+@contextmanager
+def request_scope():
+    """Share loaders between everything that runs inside the block."""
+    token = _loaders.set({})
+    try:
+        yield
+    finally:
+        _loaders.reset(token)
+
+
+async def fetch_by_ids(db, model, ids, eager=()) -> dict:
+    """Rows of model for ids, by id, eager loading the eager relationships. Missing ids are left out."""
+    found = {}
+    ids = list(ids)
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        stmt = select(model).where(model.id.in_(ids[start:start + ID_CHUNK_SIZE]))
+        if eager:
+            stmt = stmt.options(*(joinedload(relationship) for relationship in eager))
+        for row in (await db.scalars(stmt)).unique():
+            found[row.id] = row
+    return found
+
+
+class BatchLoader:
+    def __init__(self, db, model, eager=()):
+        self.db = db
+        self.model = model
+        self.eager = eager
+        self._eager_keys = {relationship.key for relationship in eager}
+        self._pending = {}  # id -> future for the batch being gathered
+
+    def _loaded(self, ident):
+        """The row if the session already has it with nothing left to load, else None."""
+        row = self.db.sync_session.identity_map.get(Session.identity_key(self.model, ident))
+        if row is None:
+            return None
+        state = inspect(row)
+        if state.expired_attributes or self._eager_keys & state.unloaded:
+            return None
+        return row
+
+    async def load_many(self, ids) -> list:
+        """Rows for ids in the same order, None for ids that don't exist."""
+        rows = {ident: self._loaded(ident) for ident in ids}
+        missing = [ident for ident, row in rows.items() if row is None]
+        if not missing:
+            return [rows[ident] for ident in ids]
+
+        first = not self._pending
+        loop = asyncio.get_running_loop()
+        futures = {ident: self._pending.setdefault(ident, loop.create_future()) for ident in missing}
+        if first:
+            # This call starts the batch: give the other loads made alongside it a turn to join, then run it
+            await asyncio.sleep(0)
+            await self._dispatch()
+        for ident, future in futures.items():
+            rows[ident] = await future
+        return [rows[ident] for ident in ids]
+
+    async def load(self, ident):
+        return (await self.load_many([ident]))[0]
+
+    async def _dispatch(self):
+        batch, self._pending = self._pending, {}
+        # Batches for other models, or the next batch for this one, may be ready at the
+        # same time; a session runs one statement at a time, so they take turns
+        lock = self.db.info.setdefault("loader_lock", asyncio.Lock())
+        try:
+            async with lock:
+                found = await fetch_by_ids(self.db, self.model, batch, self.eager)
+        except Exception as exc:
+            for future in batch.values():
+                future.set_exception(exc)
+                future.exception()  # Raised to whoever awaits it; don't warn about the rest
+            return
+        except BaseException:
+            for future in batch.values():
+                future.cancel()  # The caller running the batch was cancelled; don't leave the rest waiting
+            raise
+        for ident, future in batch.items():
+            future.set_result(found.get(ident))
+
+
+def loader(db, model, eager=()) -> BatchLoader:
+    """The current request's loader for model rows through db, or a one-off loader outside a request."""
+    scope = _loaders.get()
+    if scope is None:
+        return BatchLoader(db, model, eager)
+    key = (db, model)
+    if key not in scope:
+        scope[key] = BatchLoader(db, model, eager)
+    return scope[key]
@@ -1,4 +1,7 @@
-from datetime import datetime, time
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Literal
 
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
@@ -6,17 +9,45 @@ from schemas import UserLogin
 import models
 import crud, schemas
 import uuid
-from models import FoodItem, Requirement, User
+from models import User
 from schemas import FoodItemCreate, FoodItemResponse
-from database import get_db
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
+import database
+from database import count_queries, get_async_db, get_read_db
+from fastapi import Depends, File, Header, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from schemas import CommunityCentreLogin
 from models import CommunityCentre
-from passlib.context import CryptContext
-
-app = FastAPI()
+import auth
+import blobstore
+import events
+import loaders
+import metrics
+import pagination
+import meals
+import passwords
+import scheduler
+import search
+import serialization
+import stats
+import tokens
+import versions
+from cache import requirements_cache
+from idempotency import idempotency_store
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tokens.token_writer.start()
+    scheduler.expiry_scheduler.start()
+    yield
+    await scheduler.expiry_scheduler.stop()
+    await tokens.token_writer.stop()
+    passwords.shutdown_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,88 +55,262 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],   # Allow all HTTP methods
     allow_headers=["*"],   # Allow all headers
+    expose_headers=["X-Next-Cursor"],  # Let browser clients read pagination cursors
 )
 
-def hash_password(password: str) -> str:
-    """Hashes a plain text password before storing it."""
-    return pwd_context.hash(password)
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verifies a password against its hashed version."""
-    return pwd_context.verify(plain_password, hashed_password)
+@app.middleware("http")
+async def record_metrics(request, call_next):
+    """
+    Time each request and count its SQL for /metrics, and expose the number of
+    statements it ran so N+1 regressions are visible. Also scopes the request's
+    batched lookups (loaders.py).
+    """
+    metrics.requests_in_flight.inc()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        with count_queries() as counter, loaders.request_scope():
+            response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        metrics.requests_in_flight.dec()
+        metrics.record_request(request, status_code, time.perf_counter() - start, counter)
+    response.headers["X-DB-Query-Count"] = str(counter.count)
+    return response
+
+@app.middleware("http")
+async def read_your_writes(request, call_next):
+    """After a successful write, send the client's reads to the primary until replicas have caught up."""
+    response = await call_next(request)
+    if request.method in ("POST", "PUT", "PATCH", "DELETE") and response.status_code < 400:
+        database.mark_write(response)
+    return response
+
+def parse_ids(ids: list[str]) -> list[str]:
+    """Ids from ?ids=, repeated and/or comma separated, in order without duplicates."""
+    parsed = list(dict.fromkeys(part.strip() for value in ids for part in value.split(",") if part.strip()))
+    if len(parsed) > loaders.BATCH_ID_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {loaders.BATCH_ID_LIMIT} ids per request")
+    return parsed
+
+def set_next_cursor(response: Response, next_cursor: str | None):
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+async def not_modified(request: Request, response: Response, scopes, extra=(), replica: bool = True) -> Response | None:
+    """Set the ETag for scopes on response; returns a 304 to send instead when the client's copy is current."""
+    tag = await versions.etag(request, scopes, extra, replica)
+    if tag is None:
+        return None
+    if versions.matches(request, tag):
+        return Response(status_code=304, headers={"ETag": tag})
+    response.headers["ETag"] = tag
+    return None
+
+def _sub_response_headers(response: Response) -> dict:
+    return {name: value for name, value in response.headers.items() if name != "content-length"}
+
+def fast_json_response(response: Response, content) -> Response:
+    """content encoded by serialization.FastJSONResponse, keeping headers already set on response."""
+    return serialization.FastJSONResponse(content, headers=_sub_response_headers(response))
+
+def encoded_json_response(response: Response, body: str) -> Response:
+    """Already encoded JSON as is, keeping headers already set on response."""
+    return Response(body, media_type="application/json", headers=_sub_response_headers(response))
+
+def ndjson_response(request: Request, stmt, id_column, schema, cursor: str | None):
+    return StreamingResponse(
+        pagination.stream_ndjson(lambda: database.read_session(request), stmt, id_column, schema, cursor),
+        media_type="application/x-ndjson",
+    )
 
 # ✅ Endpoint to add a new community center
 @app.post("/community-centres/", response_model=schemas.CommunityCentreResponse)
-def add_community_centre(centre: schemas.CommunityCentreCreate, db: Session = Depends(get_db)):
-    return crud.create_community_centre(db, centre)
+async def add_community_centre(centre: schemas.CommunityCentreCreate, db: AsyncSession = Depends(get_async_db)):
+    return await crud.create_community_centre(db, centre)
 
 # ✅ Endpoint to list all community centers
 @app.get("/community-centres/", response_model=list[schemas.CommunityCentreResponse])
-def list_community_centres(db: Session = Depends(get_db)):
-    return crud.get_community_centres(db)
+async def list_community_centres(
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    format: Literal["json", "ndjson"] = "json",
+    ids: list[str] | None = Query(None, description="Just these centres, e.g. ids=a,b,c"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    One page of centres; pass X-Next-Cursor back as cursor for the next. format=ndjson streams them all.
+    With ids, returns those centres (in that order, unknown ids skipped) from one query instead.
+    """
+    if format == "ndjson" and ids is None:
+        return ndjson_response(request, select(CommunityCentre), CommunityCentre.id, schemas.CommunityCentreResponse, cursor)
+    if cached := await not_modified(request, response, [versions.COMMUNITY_CENTRES]):
+        return cached
+    if ids is not None:
+        return await crud.get_community_centres_by_ids(db, parse_ids(ids))
+    if serialization.FAST_RESPONSES:
+        centres, next_cursor = await crud.get_community_centre_rows(db, limit, cursor)
+        set_next_cursor(response, next_cursor)
+        return fast_json_response(response, centres)
+    centres, next_cursor = await crud.get_community_centres(db, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return centres
+
+# ✅ Endpoint to find the community centres nearest to a donor
+@app.get("/community-centres/nearby", response_model=list[schemas.CommunityCentreNearbyResponse])
+async def list_nearby_community_centres(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    k: int = Query(10, ge=1, le=100),
+    radius_km: float | None = Query(None, gt=0),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Return up to k centres ordered by distance, optionally limited to radius_km."""
+    nearby = await crud.get_nearby_community_centres(db, latitude, longitude, k, radius_km)
+    return [
+        {**schemas.CommunityCentreResponse.model_validate(centre).model_dump(), "distance_km": round(distance, 3)}
+        for centre, distance in nearby
+    ]
 
 # ✅ NEW: Endpoint to fetch a community center by ID
 @app.get("/community-centres/{centre_id}", response_model=schemas.CommunityCentreResponse)
-def get_community_centre(centre_id: str, db: Session = Depends(get_db)):
-    centre = crud.get_community_centre_by_id(db, centre_id)
-    print(centre)
+async def get_community_centre(centre_id: str, db: AsyncSession = Depends(get_read_db)):
+    centre = await crud.get_community_centre_by_id(db, centre_id)
     if not centre:
         raise HTTPException(status_code=404, detail="Community centre not found")
     return centre
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@app.get("/community-centres/{centre_id}/stats", response_model=list[schemas.CentreDailyStatsResponse])
+async def get_community_centre_stats(
+    centre_id: str,
+    start: date | None = None,
+    end: date | None = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Daily requested/donated servings and fulfilment rate between start and end (default the last 30 days)."""
+    end = end or date.today()
+    start = start or end - timedelta(days=29)
+    if start > end or (end - start).days > 366:
+        raise HTTPException(status_code=400, detail="start must be before end, at most a year apart")
+    return [stats.summary(row) for row in await stats.get_centre_stats(db, centre_id, start, end)]
 
 @app.post("/community-centres/login")
-def login_community_centre(login_data: CommunityCentreLogin, db: Session = Depends(get_db)):
+async def login_community_centre(login_data: CommunityCentreLogin, db: AsyncSession = Depends(get_async_db)):
     """Logs in a community centre by verifying email and password."""
 
-    centre = db.query(CommunityCentre).filter(CommunityCentre.email == login_data.email).first()
+    centre = await crud.get_community_centre_by_email(db, login_data.email)
 
     if not centre:
         raise HTTPException(status_code=404, detail="Community centre not found")
 
     # Verify password
-    if not pwd_context.verify(login_data.password, centre.password):
+    valid, new_hash = await passwords.verify_password(login_data.password, centre.password)
+    if not valid:
         raise HTTPException(status_code=400, detail="Incorrect password")
+    if new_hash:
+        await crud.update_password_hash(db, centre, new_hash)
 
-    return {"message": "Login successful", "community_centre_id": schemas.CommunityCentreResponse.model_validate(centre)}
+    return {
+        "message": "Login successful",
+        "community_centre_id": schemas.CommunityCentreResponse.model_validate(centre),
+        **auth.issue_tokens(centre.id, "centre"),
+    }
 
 
 # End User Endpoints
 
 @app.post("/users/", response_model=schemas.UserResponse)
-def add_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def add_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     # Check if email already exists
-    existing_user = db.query(User).filter(User.email == user.email).first()
+    existing_user = await crud.get_user_by_email(db, user.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered.")
 
-    return crud.create_user(db, user)
+    return await crud.create_user(db, user)
 
 @app.get("/users/{user_id}", response_model=schemas.UserResponse)
-def get_user(user_id: str, db: Session = Depends(get_db)):
-    user = crud.get_user_by_id(db, user_id)
+async def get_user(user_id: str, db: AsyncSession = Depends(get_read_db)):
+    user = await crud.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 @app.get("/users/", response_model=list[schemas.UserResponse])
-def list_users(db: Session = Depends(get_db)):
-    return crud.get_all_users(db)
+async def list_users(
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    format: Literal["json", "ndjson"] = "json",
+    ids: list[str] | None = Query(None, description="Just these users, e.g. ids=a,b,c"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    One page of users; pass X-Next-Cursor back as cursor for the next. format=ndjson streams them all.
+    With ids, returns those users (in that order, unknown ids skipped) from one query instead.
+    """
+    if ids is not None:
+        return await crud.get_users_by_ids(db, parse_ids(ids))
+    if format == "ndjson":
+        return ndjson_response(request, select(User), User.id, schemas.UserResponse, cursor)
+    users, next_cursor = await crud.get_all_users(db, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return users
 
 # Requirements Endpoints
 
 @app.post("/requirements/", response_model=schemas.RequirementResponse)
-def create_or_update(requirement: schemas.RequirementCreate, db: Session = Depends(get_db)):
-    return crud.create_or_update_requirement(db, requirement)
+async def create_or_update(
+    requirement: schemas.RequirementCreate,
+    idempotency_key: str | None = Header(None, max_length=255),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if idempotency_key is None:
+        return await crud.create_or_update_requirement(db, requirement)
+    return await idempotency_store.run(
+        "POST /requirements/", idempotency_key, requirement.model_dump(mode="json"),
+        lambda record: crud.create_or_update_requirement(db, requirement, before_commit=record),
+        schemas.RequirementResponse,
+    )
+
+@app.post("/requirements/batch", response_model=list[schemas.RequirementBatchItemResult])
+async def create_or_update_batch(batch: schemas.RequirementBatch, db: AsyncSession = Depends(get_async_db)):
+    """Create or update up to 1000 requirements in a single transaction, with a result per item."""
+    return await crud.create_or_update_requirements(db, batch.requirements)
 
 @app.get("/requirements/", response_model=list[schemas.RequirementResponse])
-def list_requirements(db: Session = Depends(get_db)):
-    return crud.get_requirements(db)
+async def list_requirements(
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    format: Literal["json", "ndjson"] = "json",
+    ids: list[str] | None = Query(None, description="Just these requirements, e.g. ids=a,b,c"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Fetch requirements with full community centre details, a page at a time or streamed as NDJSON.
+    With ids, returns those requirements (in that order, unknown ids skipped) from one query instead.
+    """
+    if ids is not None:
+        return await crud.get_requirements_by_ids(db, parse_ids(ids))
+    if format == "ndjson":
+        return ndjson_response(
+            request, crud.requirements_with_centres(), models.Requirement.id, schemas.RequirementResponse, cursor
+        )
+    if serialization.FAST_RESPONSES:
+        requirements, next_cursor = await crud.get_requirement_rows(db, limit, cursor)
+        set_next_cursor(response, next_cursor)
+        return fast_json_response(response, requirements)
+    requirements, next_cursor = await crud.get_requirements(db, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return requirements
 
 @app.get("/requirements/{requirement_id}", response_model=schemas.RequirementResponse)
-def get_requirement(requirement_id: str, db: Session = Depends(get_db)):
-    requirement = crud.get_requirement_by_id(db, requirement_id)
+async def get_requirement(requirement_id: str, db: AsyncSession = Depends(get_read_db)):
+    requirement = await crud.get_requirement_by_id(db, requirement_id)
     if not requirement:
         raise HTTPException(status_code=404, detail="Requirement not found")
     return requirement
@@ -113,47 +318,75 @@ def get_requirement(requirement_id: str, db: Session = Depends(get_db)):
 
 
 def get_meal_type():
-    """Determine the meal type based on the current time, extending dinner until 6 AM."""
-    now = datetime.now().time()
-
-    if time(0, 0) <= now < time(11, 0):
-        return "breakfast"
-    elif time(11, 0) <= now < time(16, 0):
-        return "lunch"
-    else:  # Dinner from 4 PM to 5:59 AM
-        return "dinner"
+    """Determine the meal type based on the current time."""
+    return meals.get_meal_type()
 
 
 @app.get("/requirements/today/", response_model=list[schemas.RequirementResponse])
-def get_today_requirements(db: Session = Depends(get_db)):
+async def get_today_requirements(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
     """Fetch all community centre requirements for the current date and meal type."""
-    now = datetime.now()
-    meal_type = get_meal_type()
-
-    # If it's between 12 AM - 6 AM, fetch previous day's requirements for dinner
-    if meal_type == "dinner" and now.hour < 6:
-        today_date = (now.date()).replace(day=now.day - 1)  # Fetch yesterday's dinner
-    else:
-        today_date = now.date()
-
-    return crud.get_requirements_by_date_and_meal_type(db, today_date, meal_type)
-
-
-@app.get("/requirements/", response_model=list[schemas.RequirementResponse])
-def get_requirements(db: Session = Depends(get_db)):
-    """Fetch all requirements with full community centre details"""
-    requirements = db.query(models.Requirement).join(models.CommunityCentre).all()
-
-    for req in requirements:
-        req.community_centre = db.query(models.CommunityCentre).filter_by(id=req.community_centre_id).first()
-
-    return requirements
+    # Cache fills read from the primary: a lagging replica read right after an
+    # invalidation would otherwise be cached until the meal window ends.
+    # The cache is what scales this endpoint's reads.
+    today_date, meal_type = meals.current_meal_slot()
+    if cached := await not_modified(request, response, [versions.slot_scope(today_date, meal_type)], replica=False):
+        return cached
+
+    async def load():
+        # Validated and encoded once per fill; hits send the cached JSON text as is
+        requirements = await crud.get_requirements_by_date_and_meal_type(db, today_date, meal_type)
+        return serialization.dumps([
+            schemas.RequirementResponse.model_validate(r, from_attributes=True).model_dump(mode="json") for r in requirements
+        ]).decode()
+
+    # Served from cache until the meal window ends or a requirement/food item write invalidates it
+    body = await requirements_cache.get_or_load(
+        (today_date.isoformat(), meal_type), load, expires_at=meals.meal_window_end().timestamp()
+    )
+    return encoded_json_response(response, body)
+
+
+@app.get("/match", response_model=list[schemas.RequirementMatchResponse])
+async def match_requirements(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    servings: int = Query(..., ge=1),
+    at: datetime | None = None,
+    k: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    The k open requirements in the current meal window that best suit a donor,
+    scored on distance, how many of the donor's servings they still need, and
+    whether the donor can get there (leaving at `at`, default now) before the window ends.
+    """
+    if at is None:
+        at = datetime.now()
+    elif at.tzinfo is not None:
+        at = at.astimezone().replace(tzinfo=None)  # Meal windows are in server local time
+    matches = await crud.match_requirements(db, latitude, longitude, servings, at, k)
+    return [
+        {"score": round(score, 4), "distance_km": round(distance, 3), "requirement": requirement}
+        for score, distance, requirement in matches
+    ]
 
 
 @app.get("/requests/{community_centre_id}", response_model=list[schemas.RequirementResponse])
-def get_requests(community_centre_id: str, db: Session = Depends(get_db)):
-    """Fetch earliest community centre requests, automatically determining meal type based on current time."""
-    requests = crud.get_requests_by_community_centre(db, community_centre_id)
+async def get_requests(
+    community_centre_id: str,
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Fetch a centre's requests from the current meal window on, earliest first; X-Next-Cursor pages through the rest."""
+    # Which requests are listed also moves on with the meal window
+    slot = meals.current_meal_slot()
+    if cached := await not_modified(request, response, [versions.centre_requests_scope(community_centre_id)], extra=slot):
+        return cached
+    requests, next_cursor = await crud.get_requests_by_community_centre(db, community_centre_id, limit, cursor)
+    set_next_cursor(response, next_cursor)
 
     if not requests:
         raise HTTPException(status_code=404, detail="No requests found")
@@ -161,82 +394,254 @@ def get_requests(community_centre_id: str, db: Session = Depends(get_db)):
     return requests
 
 @app.post("/food_items", response_model=FoodItemResponse)
-def create_food_item(food_item: FoodItemCreate, db: Session = Depends(get_db)):
-    # Validate that the requirement (request_id) exists
-    requirement = db.query(Requirement).filter(Requirement.id == food_item.request_id).first()
-    if not requirement:
-        raise HTTPException(status_code=400, detail="Invalid request_id: Requirement does not exist.")
-
-    # Validate that the user exists
-    user = db.query(User).filter(User.id == food_item.user_id).first()
-    if not user:
-        raise HTTPException(status_code=400, detail="Invalid user_id: User does not exist.")
-
-    # Create the new FoodItem
-    new_food_item = FoodItem(
-        id=str(uuid.uuid4()),  # Generate a unique ID
-        image=food_item.image,
-        title=food_item.title,
-        description=food_item.description,
-        servings=food_item.servings,
-        request_id=food_item.request_id,
-        user_id=food_item.user_id,
-        status="Open",  # Default status
+async def create_food_item(
+    food_item: FoodItemCreate,
+    idempotency_key: str | None = Header(None, max_length=255),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Retries with the same Idempotency-Key replay the first response instead of donating twice
+    if idempotency_key is None:
+        return await crud.create_food_item(db, food_item)
+    return await idempotency_store.run(
+        "POST /food_items", idempotency_key, food_item.model_dump(mode="json"),
+        lambda record: crud.create_food_item(db, food_item, before_commit=record), FoodItemResponse,
     )
 
-    db.add(new_food_item)
-    db.commit()
-    db.refresh(new_food_item)
-
-    return new_food_item
+@app.get("/food_items/search", response_model=list[schemas.FoodItemSearchResult])
+async def search_food_items(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    status: list[Literal["Open", "Approved", "In Transit", "Received", "Not fulfilled"]] | None = Query(None),
+    date_from: date | None = None,
+    date_to: date | None = None,
+    community_centre_id: str | None = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Food items whose title or description contains every word of q (or words
+    starting with them), best match first, optionally filtered by status, the
+    date of their requirement and centre. X-Next-Cursor pages through the rest.
+    """
+    results, next_cursor = await search.search_food_items(
+        db, q, limit, cursor, statuses=status, date_from=date_from, date_to=date_to,
+        community_centre_id=community_centre_id,
+    )
+    set_next_cursor(response, next_cursor)
+    return [
+        {
+            **FoodItemResponse.model_validate(food_item, from_attributes=True).model_dump(),
+            "community_centre_id": requirement.community_centre_id,
+            "date": requirement.date,
+            "meal_type": requirement.meal_type,
+            "relevance": relevance,
+        }
+        for food_item, requirement, relevance in results
+    ]
 
 @app.get("/food_items/{request_id}", response_model=list[schemas.FoodItemResponseWithUser])
-def get_food_items_by_request_id(request_id: str, db: Session = Depends(get_db)):
-    # Fetch all food items for the given request_id
-    food_items = db.query(FoodItem).filter(FoodItem.request_id == request_id).all()
+async def get_food_items_by_request_id(
+    request_id: str,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
+):
+    # Donors are embedded with their token counts, so token changes count as a change too
+    if cached := await not_modified(request, response, [versions.food_items_scope(request_id), versions.TOKEN_COUNTS]):
+        return cached
+    # Fetch all food items for the given request_id, with their donors in the same query
+    if serialization.FAST_RESPONSES:
+        food_items = await crud.get_food_item_rows_by_request_id(db, request_id)
+    else:
+        food_items = await crud.get_food_items_by_request_id(db, request_id)
 
     if not food_items:
         raise HTTPException(status_code=404, detail="No food items found for the given request_id.")
 
-    return food_items
+    return fast_json_response(response, food_items) if serialization.FAST_RESPONSES else food_items
+
+@app.post("/images", response_model=schemas.ImageUploadResponse)
+async def upload_image(file: UploadFile = File(...)):
+    """
+    Stream an image into the content-addressed store; identical uploads share one blob.
+    The type is detected from the bytes, whatever the client declared.
+    """
+    digest, size, media_type = await blobstore.save_upload(file)
+    return {"image": blobstore.image_ref(digest), "digest": digest, "size": size, "content_type": media_type}
+
+def _image_response(request: Request, digest: str, path: str, media_type: str):
+    # Content-addressed, so the digest is a strong validator and the bytes never change
+    etag = f'"{digest}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "X-Content-Type-Options": "nosniff",
+        "Content-Security-Policy": "default-src 'none'; sandbox",
+    }
+    if media_type not in blobstore.IMAGE_TYPES.values():
+        headers["Content-Disposition"] = "attachment"  # Stored before uploads were checked; never render inline
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)  # Handles Range requests
+
+@app.get("/images/{digest}")
+async def download_image(digest: str, request: Request):
+    if not blobstore.exists(digest):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return _image_response(request, digest, blobstore.path_for(digest), blobstore.content_type(digest))
+
+@app.get("/images/{digest}/thumbnail")
+async def download_thumbnail(digest: str, request: Request, size: int = Query(256)):
+    if size not in blobstore.THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {blobstore.THUMBNAIL_SIZES}")
+    if not blobstore.exists(digest):
+        raise HTTPException(status_code=404, detail="Image not found")
+    path = await blobstore.thumbnail(digest, size)
+    return _image_response(request, f"{digest}-{size}", path, "image/jpeg")
 
 @app.put("/food_items/{food_item_id}/status", response_model=schemas.FoodItemResponse)
-def update_status(food_item_id: str, status_update: schemas.FoodItemStatusUpdate, db: Session = Depends(get_db)):
-    return crud.update_food_item_status(db, food_item_id, status_update.status)
+async def update_status(food_item_id: str, status_update: schemas.FoodItemStatusUpdate, db: AsyncSession = Depends(get_async_db)):
+    return await crud.update_food_item_status(db, food_item_id, status_update.status)
+
+
+@app.get("/events")
+async def subscribe_events(
+    request: Request,
+    community_centre_id: list[str] = Query([]),
+    request_id: list[str] = Query([]),
+):
+    """
+    Server-sent events for requirement and food item changes.
+    Filter by any number of community_centre_id / request_id values; with none, every event is sent.
+    """
+    topics = {f"centre:{centre_id}" for centre_id in community_centre_id} | {f"request:{rid}" for rid in request_id}
+    subscription = events.broker.subscribe(topics)
+    return StreamingResponse(
+        events.stream(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/users/{user_id}/token_count", response_model=int)
-def get_token_count(user_id: uuid.UUID, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == str(user_id)).first()
+async def get_token_count(user_id: uuid.UUID, db: AsyncSession = Depends(get_read_db)):
+    token_count = await crud.get_token_count(db, str(user_id))
 
-    if not user:
+    if token_count is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return user.token_count
+    return token_count
 
-@app.put("/users/{user_id}/token_count", response_model=schemas.UserResponse)
-def update_token_count(user_id: uuid.UUID, token_count: int, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == str(user_id)).first()
+@app.put("/users/{user_id}/token_count", response_model=schemas.UserResponse, deprecated=True)
+async def update_token_count(
+    user_id: uuid.UUID,
+    token_count: int = Query(..., ge=0),
+    principal: auth.Principal = Depends(auth.require_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Overwrite a balance with an absolute value. Centres only; use increment/decrement instead."""
+    if principal.kind != "centre":
+        raise HTTPException(status_code=403, detail="Only community centres can award tokens")
+    user = await crud.update_token_count(db, str(user_id), token_count, reference_id=principal.subject)
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    user.token_count = token_count
-    db.commit()
-    db.refresh(user)
     return user
 
+@app.post("/users/{user_id}/token_count/increment", response_model=schemas.UserResponse)
+async def increment_token_count(
+    user_id: uuid.UUID,
+    change: schemas.TokenChange,
+    principal: auth.Principal = Depends(auth.require_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Atomically add tokens; safe to call concurrently, unlike PUT with an absolute value. Centres only."""
+    if principal.kind != "centre":
+        raise HTTPException(status_code=403, detail="Only community centres can award tokens")
+    return await crud.change_token_count(db, str(user_id), change.amount, change.reason, reference_id=principal.subject)
+
+@app.post("/users/{user_id}/token_count/decrement", response_model=schemas.UserResponse)
+async def decrement_token_count(
+    user_id: uuid.UUID,
+    change: schemas.TokenChange,
+    principal: auth.Principal = Depends(auth.require_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Atomically spend tokens; only the user themselves can, and 409 if they don't have enough."""
+    if principal.kind != "user" or principal.subject != str(user_id):
+        raise HTTPException(status_code=403, detail="Not allowed to spend this user's tokens")
+    return await crud.change_token_count(db, str(user_id), -change.amount, change.reason, reference_id=principal.subject)
+
+@app.get("/users/{user_id}/token_ledger", response_model=list[schemas.TokenLedgerEntry])
+async def get_token_ledger(
+    user_id: uuid.UUID,
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """A user's token history, newest first. Unapplied entries are awards still being added to the balance."""
+    return await crud.get_token_ledger(db, str(user_id), limit)
+
+@app.get("/leaderboard", response_model=list[schemas.LeaderboardEntry])
+async def get_leaderboard(
+    limit: int = Query(10, ge=1, le=tokens.LEADERBOARD_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Top users by token count."""
+    top = await crud.get_leaderboard(db, limit)
+    return [
+        {"rank": rank, "user_id": user_id, "name": name, "token_count": token_count}
+        for rank, (user_id, name, token_count) in enumerate(top, start=1)
+    ]
+
 @app.post("/users/login")
-def login_user(user_data: UserLogin, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == user_data.email).first()
+async def login_user(user_data: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    user = await crud.get_user_by_email(db, user_data.email)
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    if not verify_password(user_data.password, user.password):
+    valid, new_hash = await passwords.verify_password(user_data.password, user.password)
+    if not valid:
         raise HTTPException(status_code=400, detail="Incorrect password")
+    if new_hash:
+        await crud.update_password_hash(db, user, new_hash)
+
+    return {
+        "message": "Login successful",
+        "user_id": schemas.UserResponse.model_validate(user),
+        **auth.issue_tokens(user.id, "user"),
+    }
+
+
+@app.post("/auth/refresh", response_model=schemas.TokenPair)
+async def refresh_tokens(body: schemas.TokenRefresh):
+    """Swap a refresh token for a new access/refresh pair. Each refresh token works once."""
+    return auth.refresh_tokens(body.refresh_token)
+
+@app.post("/auth/logout", status_code=204)
+async def logout(body: schemas.Logout | None = None, principal: auth.Principal = Depends(auth.require_principal)):
+    """Revoke the current access token, and the refresh token if one is given."""
+    auth.revoked_tokens.add(principal.token_id, principal.expires_at)
+    if body and body.refresh_token:
+        auth.revoke(body.refresh_token, "refresh")
+
+@app.get("/auth/me", response_model=schemas.PrincipalResponse)
+async def get_current_principal(principal: auth.Principal = Depends(auth.require_principal)):
+    return principal
+
+
+
 
-    return {"message": "Login successful", "user_id": schemas.UserResponse.model_validate(user)}
 
+@app.get("/scheduler/status")
+async def get_scheduler_status():
+    """This worker's expiry scheduler: whether it runs, when it next will, and what the last run changed."""
+    return scheduler.expiry_scheduler.status()
 
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Latency, status code, SQL and password hashing metrics in the Prometheus text format (per worker process)."""
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4")
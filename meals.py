@@ -0,0 +1,49 @@
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import case
+
+# Start of each meal window; each runs until the next one starts, dinner until midnight
+MEAL_WINDOWS = [
+    ("breakfast", time(0, 0)),
+    ("lunch", time(11, 0)),
+    ("dinner", time(16, 0)),
+]
+
+# Position of each meal within a day, for ordering and comparing slots
+MEAL_ORDER = {name: position for position, (name, _) in enumerate(MEAL_WINDOWS)}
+
+
+def meal_order(meal_type_column):
+    """SQL expression ranking a meal_type column by when the meal happens in the day."""
+    return case(MEAL_ORDER, value=meal_type_column, else_=len(MEAL_ORDER))
+
+
+def get_meal_type(now: datetime = None) -> str:
+    """Determine the meal type based on the current time."""
+    current = (now or datetime.now()).time()
+    meal_type = MEAL_WINDOWS[0][0]
+    for name, start in MEAL_WINDOWS:
+        if current >= start:
+            meal_type = name
+    return meal_type
+
+
+def current_meal_slot(now: datetime = None) -> tuple[date, str]:
+    """The (date, meal_type) whose requirements donors should see right now."""
+    now = now or datetime.now()
+    meal_type = get_meal_type(now)
+
+    # Late-night dinner service belongs to the previous day's dinner
+    if meal_type == "dinner" and now.hour < 6:
+        return now.date() - timedelta(days=1), meal_type
+    return now.date(), meal_type
+
+
+def meal_window_end(now: datetime = None) -> datetime:
+    """When the current meal window ends and get_meal_type() changes."""
+    now = now or datetime.now()
+    for _, start in MEAL_WINDOWS:
+        boundary = datetime.combine(now.date(), start)
+        if boundary > now:
+            return boundary
+    return datetime.combine(now.date() + timedelta(days=1), MEAL_WINDOWS[0][1])
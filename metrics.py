@@ -0,0 +1,148 @@
+import bisect
+import logging
+import os
+
+# Requests slower than this (seconds) are logged with their SQL; 0 disables the log
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+slow_log = logging.getLogger("foodbridge.slow_requests")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._values = {} if self.label_names else {(): 0}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _labels(self.label_names, labels), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *labels):
+        series = self._series.setdefault(labels, [0] * len(self.buckets) + [0, 0])
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self):
+        names = self.label_names + ("le",)
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket", _labels(names, labels + (_number(bound),)), cumulative
+            yield f"{self.name}_bucket", _labels(names, labels + ("+Inf",)), series[-1]
+            yield f"{self.name}_sum", _labels(self.label_names, labels), series[-2]
+            yield f"{self.name}_count", _labels(self.label_names, labels), series[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to produce a response, by route.", ["method", "route"]
+))
+requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Requests currently being handled."
+))
+responses = registry.register(Counter(
+    "http_responses_total", "Responses sent, by route and status code.", ["method", "route", "status"]
+))
+db_queries = registry.register(Histogram(
+    "db_queries_per_request", "SQL statements run per request.", ["route"], buckets=QUERY_COUNT_BUCKETS
+))
+db_time = registry.register(Histogram(
+    "db_time_per_request_seconds", "Time spent executing SQL per request.", ["route"]
+))
+password_work = registry.register(Histogram(
+    "password_work_seconds", "bcrypt CPU time per operation, measured in the worker.", ["operation"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+))
+password_wait = registry.register(Histogram(
+    "password_queue_wait_seconds", "Time password operations spent waiting for a pool worker.", ["operation"]
+))
+password_rejections = registry.register(Counter(
+    "password_rejections_total", "Password operations shed with 503 because the pool queue was full."
+))
+
+
+def route_label(request) -> str:
+    """The route template (e.g. /users/{user_id}) so metrics don't get one series per id."""
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+def record_request(request, status_code: int, duration: float, counter):
+    route = route_label(request)
+    request_duration.observe(duration, request.method, route)
+    responses.inc(request.method, route, str(status_code))
+    db_queries.observe(counter.count, route)
+    db_time.observe(counter.duration, route)
+
+    if SLOW_REQUEST_SECONDS and duration >= SLOW_REQUEST_SECONDS:
+        statements = "\n".join(
+            f"  [{elapsed * 1000:.1f} ms] {statement}" for statement, elapsed in counter.timings
+        )
+        slow_log.warning(
+            "Slow request %s %s: %.3fs, %d queries, %.3fs in SQL\n%s",
+            request.method, request.url.path, duration, counter.count, counter.duration, statements,
+        )
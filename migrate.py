@@ -0,0 +1,162 @@
+"""
+Applies schema changes to an existing database created by create_db.py.
+
+Run `python migrate.py`. Each migration runs in its own transaction and is
+recorded in schema_migrations, so re-running only applies the new ones.
+Migrations are written to be no-ops on a fresh database from create_db.py.
+"""
+import uuid
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import Column, DateTime, MetaData, String, Table, delete, func, select, text, update
+
+import blobstore
+import models
+import search
+import stats
+from database import engine
+
+migration_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("name", String(100), primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def _0001_requirement_indexes(conn):
+    """Unique (centre, date, meal) requirements plus lookup indexes for requirements and food items."""
+    requirements = models.Requirement.__table__
+    food_items = models.FoodItem.__table__
+    natural_key = (requirements.c.community_centre_id, requirements.c.date, requirements.c.meal_type)
+
+    # Collapse duplicate requirements so the unique index can be built,
+    # keeping the lowest id and moving its duplicates' food items onto it
+    duplicates = conn.execute(
+        select(*natural_key, func.min(requirements.c.id))
+        .group_by(*natural_key)
+        .having(func.count() > 1)
+    ).all()
+    for centre_id, day, meal_type, keep_id in duplicates:
+        duplicate_ids = conn.scalars(
+            select(requirements.c.id).where(
+                requirements.c.community_centre_id == centre_id,
+                requirements.c.date == day,
+                requirements.c.meal_type == meal_type,
+                requirements.c.id != keep_id,
+            )
+        ).all()
+        conn.execute(
+            update(food_items).where(food_items.c.request_id.in_(duplicate_ids)).values(request_id=keep_id)
+        )
+        conn.execute(delete(requirements).where(requirements.c.id.in_(duplicate_ids)))
+
+    for index in [*requirements.indexes, *food_items.indexes]:
+        index.create(conn, checkfirst=True)
+
+
+def _0002_food_item_images_to_blobs(conn):
+    """Move base64 data URI images out of food_items into the blob store, then shrink the column."""
+    food_items = models.FoodItem.__table__
+    last_id = ""
+    while True:
+        batch = conn.execute(
+            select(food_items.c.id, food_items.c.image)
+            .where(food_items.c.id > last_id, food_items.c.image.like("data:%"))
+            .order_by(food_items.c.id)
+            .limit(100)
+        ).all()
+        if not batch:
+            break
+        for food_item_id, image in batch:
+            try:
+                data = blobstore.decode_data_uri(image)
+                if data is None:
+                    continue
+                ref = blobstore.image_ref(blobstore.save_bytes(data))
+            except HTTPException:
+                continue  # Not an image we serve; left in the row, so the column isn't shrunk below it
+            conn.execute(update(food_items).where(food_items.c.id == food_item_id).values(image=ref))
+        last_id = batch[-1][0]
+
+    # SQLite ignores VARCHAR lengths, so only MySQL needs the column changed
+    longest = conn.scalar(select(func.max(func.length(food_items.c.image)))) or 0
+    if conn.dialect.name == "mysql" and longest <= food_items.c.image.type.length:
+        conn.execute(text(f"ALTER TABLE food_items MODIFY image VARCHAR({food_items.c.image.type.length}) NOT NULL"))
+
+
+def _0003_token_ledger(conn):
+    """Token ledger table and the users.token_count index, with each existing balance as an opening entry."""
+    users = models.User.__table__
+    ledger = models.TokenLedger.__table__
+    ledger.create(conn, checkfirst=True)
+    for index in users.indexes:
+        if index.columns.keys() == ["token_count"]:
+            index.create(conn, checkfirst=True)
+
+    last_id = ""
+    while True:
+        batch = conn.execute(
+            select(users.c.id, users.c.token_count)
+            .where(users.c.id > last_id)
+            .order_by(users.c.id)
+            .limit(1000)
+        ).all()
+        if not batch:
+            break
+        opening = [
+            {"id": str(uuid.uuid4()), "user_id": user_id, "delta": token_count, "reason": "opening_balance",
+             "applied": True, "created_at": datetime.utcnow()}
+            for user_id, token_count in batch
+            if token_count
+        ]
+        if opening:
+            conn.execute(ledger.insert(), opening)
+        last_id = batch[-1][0]
+
+
+def _0004_centre_daily_stats(conn):
+    """Per centre and day stats table, filled from the existing requirements and food items."""
+    models.CentreDailyStats.__table__.create(conn, checkfirst=True)
+    stats.recompute(conn)
+
+
+def _0005_idempotency_keys(conn):
+    """Stored responses for requests sent with an Idempotency-Key."""
+    models.IdempotencyKey.__table__.create(conn, checkfirst=True)
+
+
+def _0006_food_item_search(conn):
+    """Full-text index over food item titles and descriptions (FTS5 on SQLite, FULLTEXT on MySQL)."""
+    search.install(conn)
+
+
+MIGRATIONS = [
+    ("0001_requirement_indexes", _0001_requirement_indexes),
+    ("0002_food_item_images_to_blobs", _0002_food_item_images_to_blobs),
+    ("0003_token_ledger", _0003_token_ledger),
+    ("0004_centre_daily_stats", _0004_centre_daily_stats),
+    ("0005_idempotency_keys", _0005_idempotency_keys),
+    ("0006_food_item_search", _0006_food_item_search),
+]
+
+
+def migrate(bind=engine):
+    migration_metadata.create_all(bind)
+    with bind.connect() as conn:
+        applied = set(conn.scalars(select(schema_migrations.c.name)))
+
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        with bind.begin() as conn:
+            migration(conn)
+            conn.execute(schema_migrations.insert().values(name=name, applied_at=datetime.utcnow()))
+        print(f"Applied {name}")
+
+
+if __name__ == "__main__":
+    migrate()
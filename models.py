@@ -1,11 +1,9 @@
 import uuid
+from datetime import datetime
 from database import Base
-from sqlalchemy import Column, String, Float, Integer, Date, ForeignKey, Enum
+from sqlalchemy import Boolean, Column, DateTime, String, Text, Float, Integer, Date, ForeignKey, Enum, Index
 from sqlalchemy.orm import relationship
-from passlib.context import CryptContext
-
-# Initialize password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from passwords import pwd_context
 
 class CommunityCentre(Base):
     __tablename__ = "community_centres"
@@ -30,7 +28,7 @@ class User(Base):
     contact = Column(String(20), nullable=False, unique=True)
     email = Column(String(100), unique=True, nullable=False)
     password = Column(String(255), nullable=False)
-    token_count = Column(Integer, default=0)
+    token_count = Column(Integer, default=0, index=True)  # Indexed for the leaderboard
 
     @staticmethod
     def hash_password(plain_password: str) -> str:
@@ -47,6 +45,11 @@ class User(Base):
 
 class Requirement(Base):
     __tablename__ = "requirements"
+    __table_args__ = (
+        # One requirement per centre, day and meal; the upsert in crud relies on this
+        Index("uq_requirements_centre_date_meal", "community_centre_id", "date", "meal_type", unique=True),
+        Index("ix_requirements_date_meal_type", "date", "meal_type"),
+    )
 
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     community_centre_id = Column(String(36), ForeignKey("community_centres.id"), nullable=False)
@@ -65,11 +68,11 @@ class FoodItem(Base):
     __tablename__ = "food_items"
 
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    image = Column(String, nullable=False)
+    image = Column(String(255), nullable=False)  # Blob store ref (/images/<sha256>) or external URL
     title = Column(String, nullable=False)
     description = Column(String, nullable=False)
     servings = Column(Integer, nullable=False)
-    request_id = Column(String(36), ForeignKey("requirements.id"), nullable=False)
+    request_id = Column(String(36), ForeignKey("requirements.id"), nullable=False, index=True)
     user_id = Column(String(36), ForeignKey("users.id"), nullable=False)
     status = Column(Enum("Open", "Approved", "In Transit", "Received", "Not fulfilled"), default="Open")
 
@@ -78,3 +81,51 @@ class FoodItem(Base):
     user = relationship("User", back_populates="food_items")
 
 
+
+
+class TokenLedger(Base):
+    """Append-only history of token changes; users.token_count is the sum of a user's applied rows."""
+    __tablename__ = "token_ledger"
+    __table_args__ = (
+        Index("ix_token_ledger_applied", "applied"),
+    )
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String(36), ForeignKey("users.id"), nullable=False, index=True)
+    delta = Column(Integer, nullable=False)
+    reason = Column(String(50), nullable=False)
+    reference_id = Column(String(36))  # e.g. the food item an award was for
+    # False until the delta has been added to users.token_count by tokens.TokenWriter
+    applied = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class CentreDailyStats(Base):
+    """
+    Per centre and day totals for the dashboard, kept current by the write paths
+    in crud and scheduler (see stats.py) so reads never scan food_items.
+    """
+    __tablename__ = "centre_daily_stats"
+
+    community_centre_id = Column(String(36), ForeignKey("community_centres.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    requirements = Column(Integer, nullable=False, default=0)
+    outstanding_servings = Column(Integer, nullable=False, default=0)  # Still needed, summed over requirements
+    # Donated servings by food item status
+    open_servings = Column(Integer, nullable=False, default=0)
+    approved_servings = Column(Integer, nullable=False, default=0)
+    in_transit_servings = Column(Integer, nullable=False, default=0)
+    received_servings = Column(Integer, nullable=False, default=0)
+    not_fulfilled_servings = Column(Integer, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    """Outcome of a request sent with an Idempotency-Key header, replayed for retries (see idempotency.py)."""
+    __tablename__ = "idempotency_keys"
+
+    key_hash = Column(String(64), primary_key=True)  # sha256 of the endpoint and the client's key
+    request_hash = Column(String(64), nullable=False)  # sha256 of the request body, to catch reused keys
+    status_code = Column(Integer)  # None while the first request is still running
+    response_body = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,77 @@
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException
+
+# Rows fetched per round trip when streaming a whole table
+STREAM_BATCH_SIZE = 500
+
+
+def encode_cursor(last_id) -> str:
+    """Opaque cursor pointing just after last_id (any JSON value, e.g. a composite key)."""
+    return base64.urlsafe_b64encode(json.dumps({"after": last_id}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded))["after"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _key_type(id_column):
+    try:
+        return id_column.type.python_type
+    except NotImplementedError:
+        return str
+
+
+def keyset(stmt, id_column, cursor: str = None):
+    """Order stmt by id_column and start after the cursor's row."""
+    if cursor:
+        after = decode_cursor(cursor)
+        # A cursor can decode to any JSON value; only the key column's type may reach the bind
+        if not isinstance(after, _key_type(id_column)):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(id_column > after)
+    return stmt.order_by(id_column)
+
+
+async def paginate(db, stmt, id_column, limit: int, cursor: str = None):
+    """One keyset page of stmt. Returns (rows, next_cursor); next_cursor is None on the last page."""
+    rows = (await db.scalars(keyset(stmt, id_column, cursor).limit(limit + 1))).all()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1].id)
+    return rows, None
+
+
+async def paginate_rows(db, stmt, id_column, limit: int, cursor: str = None):
+    """Like paginate, for a statement selecting columns: returns (row mappings, next_cursor)."""
+    rows = (await db.execute(keyset(stmt, id_column, cursor).limit(limit + 1))).mappings().all()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1][id_column.name])
+    return rows, None
+
+
+def stream_ndjson(session_factory, stmt, id_column, schema, cursor: str = None):
+    """
+    Yield every row after the cursor as one JSON object per line, fetched in
+    batches from a server-side cursor so memory stays flat however big the table is.
+    Opens its own session from session_factory because it outlives the request's dependency.
+    The cursor is checked here, before the response starts, so a bad one is still a 400.
+    """
+    stmt = keyset(stmt, id_column, cursor).execution_options(yield_per=STREAM_BATCH_SIZE)
+
+    async def lines():
+        async with session_factory() as db:
+            result = await db.stream_scalars(stmt)
+            async for partition in result.partitions():
+                yield "".join(
+                    schema.model_validate(row, from_attributes=True).model_dump_json() + "\n"
+                    for row in partition
+                )
+                db.expunge_all()  # Don't let the identity map grow with the table
+
+    return lines()
@@ -0,0 +1,92 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+import metrics
+
+# bcrypt cost; raising it makes existing hashes get upgraded on their next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Worker processes doing password work, and how many more calls may wait for one before we shed load
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "32"))
+PASSWORD_RETRY_AFTER = int(os.getenv("PASSWORD_RETRY_AFTER", "2"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_pool = None
+_pending = 0
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str):
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+def _timed(fn, *args):
+    """Runs in the worker, so the elapsed time is bcrypt alone rather than bcrypt plus queueing."""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: forking a process that runs an event loop and DB connections is unsafe
+        _pool = ProcessPoolExecutor(
+            max_workers=PASSWORD_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+async def _submit(fn, *args):
+    """Run fn in the password pool, rejecting with 503 once the queue is full."""
+    global _pending
+    if _pending >= PASSWORD_WORKERS + PASSWORD_QUEUE_LIMIT:
+        metrics.password_rejections.inc()
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, please retry shortly.",
+            headers={"Retry-After": str(PASSWORD_RETRY_AFTER)},
+        )
+
+    operation = fn.__name__.lstrip("_")
+    _pending += 1
+    start = time.perf_counter()
+    try:
+        result, work = await asyncio.get_running_loop().run_in_executor(_get_pool(), _timed, fn, *args)
+    finally:
+        _pending -= 1
+    metrics.password_work.observe(work, operation)
+    metrics.password_wait.observe(max(0.0, time.perf_counter() - start - work), operation)
+    return result
+
+
+async def hash_password(password: str) -> str:
+    """Hashes a plain text password in the password pool."""
+    return await _submit(_hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str):
+    """
+    Verifies a password in the password pool.
+    Returns (valid, new_hash); new_hash is set when the stored hash uses outdated
+    settings (e.g. a lower bcrypt cost) and should replace the stored one.
+    """
+    return await _submit(_verify_and_update, plain_password, hashed_password)
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
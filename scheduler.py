@@ -0,0 +1,188 @@
+"""
+Closes out meal windows once they have passed.
+
+At every meal-window boundary (and once at startup, to catch up) requirements
+for finished windows are marked Expired and their food items that were never
+delivered become Not fulfilled. Stored Idempotency-Key responses past their
+TTL are deleted on the same runs. Updates are set-based and run in bounded
+batches, so each transaction holds its locks briefly. They are also
+idempotent, so it is fine for every worker process to run its own scheduler.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import and_, or_, select, update
+
+import database
+import idempotency
+import meals
+import models
+import stats
+import versions
+from cache import invalidate_requirements
+from matching import CLOSED_REQUIREMENT_STATUSES
+
+EXPIRY_SCHEDULER_ENABLED = os.getenv("EXPIRY_SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "1000"))
+# Seconds after a boundary before running, so requests stamped just before it have landed
+EXPIRY_GRACE_SECONDS = float(os.getenv("EXPIRY_GRACE_SECONDS", "5"))
+
+REQUIREMENT_EXPIRED = "Expired"
+FOOD_ITEM_EXPIRED = "Not fulfilled"
+# Food items still waiting to be delivered when their meal passes
+PENDING_FOOD_ITEM_STATUSES = ("Open", "Approved")
+
+log = logging.getLogger("foodbridge.scheduler")
+
+
+def ended_slot_filter(now: datetime):
+    """SQL condition matching requirements whose (date, meal_type) window ended before now."""
+    today, current_meal = meals.current_meal_slot(now)
+    Requirement = models.Requirement
+    return or_(
+        Requirement.date < today,
+        and_(Requirement.date == today, meals.meal_order(Requirement.meal_type) < meals.MEAL_ORDER[current_meal]),
+    )
+
+
+async def expire_requirements(now: datetime, batch_size: int = EXPIRY_BATCH_SIZE):
+    """Mark open requirements from ended windows Expired. Returns (rows, batches, (centre, date, meal) keys touched)."""
+    Requirement = models.Requirement
+    expired, batches, keys = 0, 0, set()
+    while True:
+        async with database.AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(Requirement.id, Requirement.community_centre_id, Requirement.date, Requirement.meal_type)
+                .where(ended_slot_filter(now), Requirement.status.not_in(CLOSED_REQUIREMENT_STATUSES))
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            result = await db.execute(
+                update(Requirement)
+                .where(Requirement.id.in_([row.id for row in rows]), Requirement.status.not_in(CLOSED_REQUIREMENT_STATUSES))
+                .values(status=REQUIREMENT_EXPIRED)
+            )
+            await db.commit()
+        expired += result.rowcount
+        batches += 1
+        keys.update((row.community_centre_id, row.date, row.meal_type) for row in rows)
+        if len(rows) < batch_size:
+            break
+        await asyncio.sleep(0)  # Let requests run between batches
+    return expired, batches, keys
+
+
+async def expire_food_items(now: datetime, batch_size: int = EXPIRY_BATCH_SIZE):
+    """Mark undelivered food items for ended windows Not fulfilled. Returns (rows, batches)."""
+    FoodItem, Requirement = models.FoodItem, models.Requirement
+    expired, batches = 0, 0
+    while True:
+        async with database.AsyncSessionLocal() as db:
+            # Locked, so the stats below match exactly what the update changes
+            rows = (await db.execute(
+                select(
+                    FoodItem.id, FoodItem.request_id, FoodItem.status, FoodItem.servings,
+                    Requirement.community_centre_id, Requirement.date,
+                )
+                .join(FoodItem.requirement)
+                .where(ended_slot_filter(now), FoodItem.status.in_(PENDING_FOOD_ITEM_STATUSES))
+                .limit(batch_size)
+                .with_for_update(of=FoodItem)
+            )).all()
+            if not rows:
+                break
+            result = await db.execute(
+                update(FoodItem)
+                .where(FoodItem.id.in_([row.id for row in rows]), FoodItem.status.in_(PENDING_FOOD_ITEM_STATUSES))
+                .values(status=FOOD_ITEM_EXPIRED)
+            )
+
+            deltas = defaultdict(lambda: defaultdict(int))
+            for row in rows:
+                day_deltas = deltas[row.community_centre_id, row.date]
+                day_deltas[row.status] -= row.servings
+                day_deltas[FOOD_ITEM_EXPIRED] += row.servings
+            for (centre_id, day), day_deltas in deltas.items():
+                await stats.add_food_item_servings(db, centre_id, day, day_deltas)
+            await db.commit()
+        await versions.bump(*(versions.food_items_scope(row.request_id) for row in rows))
+        expired += result.rowcount
+        batches += 1
+        if len(rows) < batch_size:
+            break
+        await asyncio.sleep(0)
+    return expired, batches
+
+
+class ExpiryScheduler:
+    def __init__(self, enabled: bool = EXPIRY_SCHEDULER_ENABLED):
+        self.enabled = enabled
+        self.runs = 0
+        self.last_run = None
+        self.next_run_at = None
+        self._task = None
+
+    async def run_once(self, now: datetime = None) -> dict:
+        """Expire everything from windows that ended before now, and record the run's stats."""
+        now = now or datetime.now()
+        started = time.perf_counter()
+        run = {"started_at": now.isoformat(timespec="seconds"), "error": None}
+        try:
+            food_items, food_item_batches = await expire_food_items(now)
+            requirements, requirement_batches, keys = await expire_requirements(now)
+            for day, meal_type in {(day, meal_type) for _, day, meal_type in keys}:
+                await invalidate_requirements(day, meal_type)
+            await versions.requirements_changed(keys)
+            idempotency_keys = await idempotency.purge_expired()
+            run.update(
+                requirements_expired=requirements,
+                food_items_expired=food_items,
+                idempotency_keys_purged=idempotency_keys,
+                batches=food_item_batches + requirement_batches,
+            )
+        except Exception as exc:
+            log.exception("Expiry run failed")
+            run["error"] = repr(exc)
+        run["duration_seconds"] = round(time.perf_counter() - started, 3)
+        self.runs += 1
+        self.last_run = run
+        return run
+
+    async def _run(self):
+        await self.run_once()  # Catch up on anything that ended while we were down
+        while True:
+            self.next_run_at = meals.meal_window_end()
+            delay = (self.next_run_at - datetime.now()).total_seconds() + EXPIRY_GRACE_SECONDS
+            await asyncio.sleep(max(delay, 0))
+            await self.run_once()
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None and not self._task.done(),
+            "runs": self.runs,
+            "next_run_at": self.next_run_at.isoformat(timespec="seconds") if self.next_run_at else None,
+            "last_run": self.last_run,
+        }
+
+
+# Shared per-process scheduler, started and stopped by the app lifespan
+expiry_scheduler = ExpiryScheduler()
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from datetime import date
+from pydantic import BaseModel, EmailStr, Field
+from datetime import date, datetime
 from typing import Optional, Literal
 import uuid
 
@@ -25,6 +25,17 @@ class CommunityCentreResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CommunityCentreNearbyResponse(CommunityCentreResponse):
+    distance_km: float
+
+class CentreDailyStatsResponse(BaseModel):
+    date: date
+    requirements: int
+    requested_servings: int
+    outstanding_servings: int
+    donated_servings: dict[str, int]  # By food item status
+    fulfilment_rate: Optional[float]  # Received / requested; None when nothing was requested
+
 class UserBase(BaseModel):
     name: str
     address: str
@@ -72,11 +83,25 @@ class RequirementResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class RequirementBatch(BaseModel):
+    requirements: list[RequirementCreate] = Field(..., min_length=1, max_length=1000)
+
+class RequirementBatchItemResult(BaseModel):
+    index: int  # Position of the item in the submitted batch
+    status: Literal["created", "updated", "error"]
+    requirement: Optional[RequirementResponse] = None
+    error: Optional[str] = None
+
 from pydantic import BaseModel
 from typing import Optional
 
+class RequirementMatchResponse(BaseModel):
+    score: float
+    distance_km: float
+    requirement: RequirementResponse
+
 class FoodItemCreate(BaseModel):
-    image: str
+    image: str  # Ref returned by POST /images; base64 data URIs are still accepted and stored as blobs
     title: str
     description: str
     servings: int
@@ -90,6 +115,12 @@ class FoodItemResponse(FoodItemCreate):
     class Config:
         orm_mode = True
 
+class FoodItemSearchResult(FoodItemResponse):
+    community_centre_id: str
+    date: date
+    meal_type: str
+    relevance: float  # Higher is a better match; only comparable within one search
+
 from pydantic import BaseModel
 
 class UserResponse(BaseModel):
@@ -111,6 +142,12 @@ class FoodItemResponseWithUser(BaseModel):
     status: str
     user: UserResponse  # Embed user details
 
+class ImageUploadResponse(BaseModel):
+    image: str  # Use as FoodItemCreate.image
+    digest: str
+    size: int
+    content_type: str
+
 class FoodItemStatusUpdate(BaseModel):
     status: Literal["Open", "Approved", "In Transit", "Received", "Not fulfilled"]
 
@@ -118,10 +155,51 @@ class FoodItemStatusUpdate(BaseModel):
 class TokenUpdate(BaseModel):
     token_count: int
 
+class TokenChange(BaseModel):
+    amount: int = Field(..., ge=1)
+    reason: str = Field("adjustment", min_length=1, max_length=40, pattern=r"^[a-z0-9_]+$")
+
+class TokenLedgerEntry(BaseModel):
+    id: str
+    delta: int
+    reason: str
+    reference_id: Optional[str] = None
+    applied: bool
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: str
+    name: str
+    token_count: int
+
 class CommunityCentreLogin(BaseModel):
     email: EmailStr
     password: str
 
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
+class Logout(BaseModel):
+    refresh_token: Optional[str] = None
+
+class TokenPair(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str
+    expires_in: int
+
+class PrincipalResponse(BaseModel):
+    subject: str
+    kind: Literal["user", "centre"]
+    expires_at: int
+
+    class Config:
+        from_attributes = True
+
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
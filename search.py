@@ -0,0 +1,142 @@
+"""
+Full-text search over food item titles and descriptions.
+
+The index is the database's own, chosen by dialect: an external-content FTS5
+table kept in step with food_items by triggers on SQLite, and a FULLTEXT index
+on MySQL, which InnoDB maintains itself. Only the text is indexed; status,
+date and centre filters are applied through the food_items and requirements
+rows of the matches.
+
+Every word of a query has to match, as a word or the start of one
+("veg" finds "vegetarian"). Results are ranked by BM25 on SQLite and by
+InnoDB's relevance on MySQL, and paged with a (score, id) keyset cursor.
+"""
+import re
+from datetime import date
+
+from fastapi import HTTPException
+from sqlalchemy import and_, column, event, func, inspect, literal_column, or_, select, table, text
+from sqlalchemy.dialects.mysql import match as mysql_match
+
+import models
+from pagination import decode_cursor, encode_cursor
+
+FTS_TABLE = "food_items_fts"
+FULLTEXT_INDEX = "ft_food_items_title_description"
+# Most words used from a query
+MAX_QUERY_TERMS = 16
+# Title matches count for more than description matches (SQLite only; MySQL weighs columns equally)
+TITLE_WEIGHT = 2.0
+
+fts_table = table(FTS_TABLE, column("rowid"))
+
+SQLITE_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, description, content='food_items', content_rowid='rowid', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON food_items BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.rowid, new.title, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON food_items BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) VALUES ('delete', old.rowid, old.title, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, description ON food_items BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) VALUES ('delete', old.rowid, old.title, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.rowid, new.title, new.description);
+    END""",
+]
+
+
+def install(conn):
+    """Create the search index for conn's dialect if it's missing, and fill it from existing rows. Other dialects get none."""
+    dialect_name = conn.dialect.name
+    if dialect_name == "sqlite":
+        for statement in SQLITE_DDL:
+            conn.execute(text(statement))
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    elif dialect_name == "mysql":
+        if FULLTEXT_INDEX not in {index["name"] for index in inspect(conn).get_indexes("food_items")}:
+            conn.execute(text(f"ALTER TABLE food_items ADD FULLTEXT INDEX {FULLTEXT_INDEX} (title, description)"))
+
+
+# Databases created with create_all get the index along with the table
+event.listen(models.FoodItem.__table__, "after_create", lambda target, conn, **kw: install(conn))
+
+
+def query_terms(query: str) -> list[str]:
+    """Words of a search query, lower-cased, without operators or punctuation."""
+    return re.findall(r"\w+", query.lower())[:MAX_QUERY_TERMS]
+
+
+def _match(dialect_name: str, terms: list[str]):
+    """(where clause, score) for rows matching every term, lower scores ranking first."""
+    if dialect_name == "sqlite":
+        fts = literal_column(FTS_TABLE)
+        expression = " ".join(f'"{term}"*' for term in terms)
+        return fts.op("MATCH")(expression), func.bm25(fts, TITLE_WEIGHT, 1.0)
+    if dialect_name == "mysql":
+        relevance = mysql_match(
+            models.FoodItem.title, models.FoodItem.description,
+            against=" ".join(f"+{term}*" for term in terms),
+        ).in_boolean_mode()
+        return relevance > 0, -relevance
+    raise NotImplementedError(f"No food item search for dialect {dialect_name!r}")
+
+
+async def search_food_items(
+    db,
+    query: str,
+    limit: int,
+    cursor: str = None,
+    statuses: list[str] = None,
+    date_from: date = None,
+    date_to: date = None,
+    community_centre_id: str = None,
+):
+    """
+    One page of food items matching query, best first, as (food_item, requirement, relevance)
+    rows. Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    FoodItem, Requirement = models.FoodItem, models.Requirement
+    terms = query_terms(query)
+    if not terms:
+        return [], None
+
+    dialect_name = db.get_bind().dialect.name
+    matches, score = _match(dialect_name, terms)
+    ranked = select(FoodItem.id.label("id"), score.label("score")).join(FoodItem.requirement).where(matches)
+    if dialect_name == "sqlite":
+        ranked = ranked.join(fts_table, fts_table.c.rowid == literal_column("food_items.rowid"))
+    if statuses:
+        ranked = ranked.where(FoodItem.status.in_(statuses))
+    if date_from:
+        ranked = ranked.where(Requirement.date >= date_from)
+    if date_to:
+        ranked = ranked.where(Requirement.date <= date_to)
+    if community_centre_id:
+        ranked = ranked.where(Requirement.community_centre_id == community_centre_id)
+    ranked = ranked.subquery()
+
+    stmt = (
+        select(FoodItem, Requirement, ranked.c.score)
+        .join(ranked, ranked.c.id == FoodItem.id)
+        .join(FoodItem.requirement)
+        .order_by(ranked.c.score, ranked.c.id)
+        .limit(limit + 1)
+    )
+    if cursor:
+        try:
+            after_score, after_id = decode_cursor(cursor)
+            after_score = float(after_score)
+            if not isinstance(after_id, str):
+                raise TypeError(after_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(or_(ranked.c.score > after_score, and_(ranked.c.score == after_score, ranked.c.id > after_id)))
+
+    rows = (await db.execute(stmt)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1].score, rows[-1].FoodItem.id])
+    return [(food_item, requirement, -score) for food_item, requirement, score in rows], next_cursor
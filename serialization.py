@@ -0,0 +1,67 @@
+"""
+Fast JSON for large read-only listings.
+
+The usual path loads ORM instances and has FastAPI validate every one against
+the response_model before encoding it; for a page of requirements most of
+that time goes on re-validating centre emails that were validated on the way
+in. With FAST_RESPONSES on, the listing endpoints instead select just the
+columns their schema needs as plain rows, shape them into dicts in schema
+order, and encode them in one call, with orjson if it is installed and
+pydantic-core otherwise. The JSON is the same as the usual path's. Compare
+the two with `python -m benchmarks.bench_serialization`.
+"""
+import os
+from typing import Any
+
+from pydantic import BaseModel, TypeAdapter
+from starlette.responses import Response
+
+try:
+    import orjson  # Optional; pydantic-core's encoder is used without it
+except ImportError:
+    orjson = None
+
+FAST_RESPONSES = os.getenv("FAST_RESPONSES", "false").lower() in ("1", "true", "yes")
+
+_encoder = TypeAdapter(Any)
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content) if orjson is not None else _encoder.dump_json(content)
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def _label(prefix: str | None, name: str) -> str:
+    return f"{prefix}__{name}" if prefix else name
+
+
+def _nested_schema(field):
+    annotation = field.annotation
+    return annotation if isinstance(annotation, type) and issubclass(annotation, BaseModel) else None
+
+
+def projection(schema: type[BaseModel], table, prefix: str = None) -> list:
+    """Columns of table for schema's fields, labelled for shape(). Nested models are left to their own projection."""
+    return [
+        table.c[name].label(_label(prefix, name))
+        for name, field in schema.model_fields.items()
+        if _nested_schema(field) is None and name in table.c
+    ]
+
+
+def shape(schema: type[BaseModel], row, prefix: str = None) -> dict:
+    """A projected row as the dict schema would serialise to, nested models included."""
+    content = {}
+    for name, field in schema.model_fields.items():
+        nested = _nested_schema(field)
+        if nested is not None:
+            content[name] = shape(nested, row, _label(prefix, name))
+        else:
+            content[name] = row[_label(prefix, name)]
+    return content
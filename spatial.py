@@ -0,0 +1,122 @@
+import math
+import time
+from threading import Lock
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM  # Half the circumference, nothing is further away
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class CentreIndex:
+    """
+    Grid-bucketed spatial index over community centre coordinates.
+
+    Points are hashed into fixed-size lat/lon cells, so a radius query only
+    visits the cells overlapping the circle's bounding box instead of every
+    centre. K-nearest queries grow the search radius until k hits are found.
+    """
+
+    def __init__(self, cell_deg: float = 0.1, ttl_seconds: float = 300):
+        self.cell_deg = cell_deg
+        self.ttl_seconds = ttl_seconds
+        self._lat_cells = math.ceil(180 / cell_deg)
+        self._lon_cells = math.ceil(360 / cell_deg)
+        self._cells: dict[tuple[int, int], dict[str, tuple[float, float]]] = {}
+        self._points: dict[str, tuple[int, int]] = {}
+        self._loaded_at = None
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        row = min(int((lat + 90) // self.cell_deg), self._lat_cells - 1)
+        col = int(((lon + 180) % 360) // self.cell_deg) % self._lon_cells
+        return row, col
+
+    def is_stale(self) -> bool:
+        """True until the index is loaded, and again once the TTL has passed."""
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl_seconds
+
+    def load(self, rows):
+        """Replace the index contents with (id, latitude, longitude) rows."""
+        cells, points = {}, {}
+        for centre_id, lat, lon in rows:
+            cell = self._cell(lat, lon)
+            cells.setdefault(cell, {})[centre_id] = (lat, lon)
+            points[centre_id] = cell
+        with self._lock:
+            self._cells, self._points = cells, points
+            self._loaded_at = time.monotonic()
+
+    def insert(self, centre_id: str, lat: float, lon: float):
+        """Add or move a single centre."""
+        cell = self._cell(lat, lon)
+        with self._lock:
+            old_cell = self._points.get(centre_id)
+            if old_cell is not None:
+                self._cells[old_cell].pop(centre_id, None)
+            self._cells.setdefault(cell, {})[centre_id] = (lat, lon)
+            self._points[centre_id] = cell
+
+    def _candidate_cells(self, lat: float, lon: float, radius_km: float):
+        """Cells overlapping the bounding box of the search circle."""
+        d_lat = radius_km / KM_PER_DEGREE
+        row_lo = self._cell(max(lat - d_lat, -90), 0)[0]
+        row_hi = self._cell(min(lat + d_lat, 90), 0)[0]
+
+        # Longitude span of the circle; the whole band when it reaches a pole
+        angular = radius_km / EARTH_RADIUS_KM
+        cos_lat = math.cos(math.radians(lat))
+        if lat + d_lat >= 90 or lat - d_lat <= -90 or math.sin(angular) >= cos_lat:
+            cols = range(self._lon_cells)
+        else:
+            d_lon = math.degrees(math.asin(math.sin(angular) / cos_lat))
+            col_lo = self._cell(lat, lon - d_lon)[1]
+            span = min(int(2 * d_lon // self.cell_deg) + 2, self._lon_cells)
+            cols = [(col_lo + i) % self._lon_cells for i in range(span)]
+
+        n_cells = (row_hi - row_lo + 1) * len(cols)
+        if n_cells > len(self._cells):
+            # Sparse index: cheaper to filter the occupied cells than enumerate the box
+            col_set = set(cols)
+            return [
+                cell for cell in self._cells
+                if row_lo <= cell[0] <= row_hi and cell[1] in col_set
+            ]
+        return [(row, col) for row in range(row_lo, row_hi + 1) for col in cols]
+
+    def within(self, lat: float, lon: float, radius_km: float) -> list[tuple[float, str]]:
+        """All centres within radius_km, as (distance_km, id) sorted nearest first."""
+        with self._lock:
+            hits = []
+            for cell in self._candidate_cells(lat, lon, radius_km):
+                for centre_id, (c_lat, c_lon) in self._cells.get(cell, {}).items():
+                    distance = haversine_km(lat, lon, c_lat, c_lon)
+                    if distance <= radius_km:
+                        hits.append((distance, centre_id))
+        hits.sort()
+        return hits
+
+    def nearest(self, lat: float, lon: float, k: int, max_radius_km: float = None) -> list[tuple[float, str]]:
+        """The k closest centres, optionally capped to max_radius_km."""
+        limit = min(max_radius_km or MAX_DISTANCE_KM, MAX_DISTANCE_KM)
+        radius = min(self.cell_deg * KM_PER_DEGREE, limit)
+        while True:
+            hits = self.within(lat, lon, radius)
+            if len(hits) >= k or radius >= limit:
+                return hits[:k]
+            radius = min(radius * 2, limit)
+
+
+# Shared per-process index, kept current by crud.create_community_centre
+centre_index = CentreIndex()
@@ -0,0 +1,151 @@
+"""
+Per centre and day fulfilment statistics.
+
+centre_daily_stats is maintained inside the same transactions as the writes
+that change it: requirement totals are recomputed from the centre's (at most
+three) requirements for the day, and food item servings are moved between
+status columns by delta. Run `python stats.py` to rebuild the table from
+scratch if it ever drifts.
+"""
+from collections import defaultdict
+
+from sqlalchemy import case, delete, func, select, tuple_, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import models
+from database import engine
+
+# Food item status -> column holding that status's servings
+STATUS_COLUMNS = {
+    "Open": "open_servings",
+    "Approved": "approved_servings",
+    "In Transit": "in_transit_servings",
+    "Received": "received_servings",
+    "Not fulfilled": "not_fulfilled_servings",
+}
+
+# Keys per statement, to stay under driver/SQLite parameter limits
+KEY_CHUNK_SIZE = 500
+
+stats_table = models.CentreDailyStats.__table__
+
+
+def _upsert(dialect_name: str, rows, increment: list[str]):
+    """Insert stats rows, or add the increment columns onto rows that already exist."""
+    if dialect_name == "mysql":
+        stmt = mysql_insert(stats_table).values(rows)
+        return stmt.on_duplicate_key_update(
+            {column: stats_table.c[column] + stmt.inserted[column] for column in increment}
+            or {"community_centre_id": stmt.inserted.community_centre_id}
+        )
+    if dialect_name == "sqlite":
+        stmt = sqlite_insert(stats_table).values(rows)
+        key = [stats_table.c.community_centre_id, stats_table.c.date]
+        if not increment:
+            return stmt.on_conflict_do_nothing(index_elements=key)
+        return stmt.on_conflict_do_update(
+            index_elements=key,
+            set_={column: stats_table.c[column] + stmt.excluded[column] for column in increment},
+        )
+    raise NotImplementedError(f"No stats upsert for dialect {dialect_name!r}")
+
+
+async def refresh_requirement_totals(db, keys):
+    """Recompute requirement counts and outstanding servings for (centre_id, date) keys."""
+    requirements = models.Requirement.__table__
+    dialect_name = db.get_bind().dialect.name
+    keys = list(set(keys))
+    for start in range(0, len(keys), KEY_CHUNK_SIZE):
+        chunk = keys[start:start + KEY_CHUNK_SIZE]
+        await db.execute(_upsert(dialect_name, [{"community_centre_id": c, "date": d} for c, d in chunk], []))
+
+        same_day = (
+            requirements.c.community_centre_id == stats_table.c.community_centre_id,
+            requirements.c.date == stats_table.c.date,
+        )
+        await db.execute(
+            update(stats_table)
+            .where(tuple_(stats_table.c.community_centre_id, stats_table.c.date).in_(chunk))
+            .values(
+                requirements=select(func.count()).where(*same_day).scalar_subquery(),
+                outstanding_servings=select(func.coalesce(func.sum(requirements.c.servings), 0))
+                .where(*same_day).scalar_subquery(),
+            )
+        )
+
+
+async def add_food_item_servings(db, centre_id: str, day, deltas: dict[str, int]):
+    """Add servings deltas, keyed by food item status, to a centre's day."""
+    columns = {STATUS_COLUMNS[status]: delta for status, delta in deltas.items() if delta}
+    if not columns:
+        return
+    row = {"community_centre_id": centre_id, "date": day, **columns}
+    await db.execute(_upsert(db.get_bind().dialect.name, [row], list(columns)))
+
+
+async def get_centre_stats(db, centre_id: str, start, end):
+    """Stats rows for a centre between start and end inclusive, oldest first."""
+    return (await db.scalars(
+        select(models.CentreDailyStats)
+        .filter(
+            models.CentreDailyStats.community_centre_id == centre_id,
+            models.CentreDailyStats.date.between(start, end),
+        )
+        .order_by(models.CentreDailyStats.date)
+    )).all()
+
+
+def summary(row: models.CentreDailyStats) -> dict:
+    """A stats row as the dashboard shows it. Requested servings are what is still needed plus what arrived."""
+    requested = row.outstanding_servings + row.received_servings
+    return {
+        "date": row.date,
+        "requirements": row.requirements,
+        "requested_servings": requested,
+        "outstanding_servings": row.outstanding_servings,
+        "donated_servings": {status: getattr(row, column) for status, column in STATUS_COLUMNS.items()},
+        "fulfilment_rate": round(row.received_servings / requested, 4) if requested else None,
+    }
+
+
+def recompute(conn):
+    """Replace every stats row with totals computed from requirements and food items."""
+    requirements = models.Requirement.__table__
+    food_items = models.FoodItem.__table__
+    rows = defaultdict(lambda: {column: 0 for column in ["requirements", "outstanding_servings", *STATUS_COLUMNS.values()]})
+
+    for centre_id, day, count, outstanding in conn.execute(
+        select(requirements.c.community_centre_id, requirements.c.date, func.count(), func.sum(requirements.c.servings))
+        .group_by(requirements.c.community_centre_id, requirements.c.date)
+    ):
+        rows[centre_id, day].update(requirements=count, outstanding_servings=outstanding or 0)
+
+    servings_by_status = [
+        func.coalesce(func.sum(case((food_items.c.status == status, food_items.c.servings), else_=0)), 0)
+        for status in STATUS_COLUMNS
+    ]
+    for centre_id, day, *servings in conn.execute(
+        select(requirements.c.community_centre_id, requirements.c.date, *servings_by_status)
+        .select_from(food_items)
+        .join(requirements, food_items.c.request_id == requirements.c.id)
+        .group_by(requirements.c.community_centre_id, requirements.c.date)
+    ):
+        rows[centre_id, day].update(zip(STATUS_COLUMNS.values(), servings))
+
+    conn.execute(delete(stats_table))
+    values = [{"community_centre_id": centre_id, "date": day, **totals} for (centre_id, day), totals in rows.items()]
+    for start in range(0, len(values), KEY_CHUNK_SIZE):
+        conn.execute(stats_table.insert(), values[start:start + KEY_CHUNK_SIZE])
+    return len(values)
+
+
+def rebuild(bind=engine) -> int:
+    """Recompute the stats table in one transaction. Returns the number of rows."""
+    with bind.begin() as conn:
+        return recompute(conn)
+
+
+if __name__ == "__main__":
+    stats_table.create(engine, checkfirst=True)
+    print(f"Rebuilt {rebuild()} centre_daily_stats rows")
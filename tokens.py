@@ -0,0 +1,179 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+from collections import defaultdict
+
+from sqlalchemy import bindparam, func, select, update
+
+import database
+import models
+import versions
+
+# Tokens a donor earns per serving delivered
+TOKENS_PER_SERVING = int(os.getenv("TOKENS_PER_SERVING", "1"))
+# Ledger rows applied per transaction, and how long the writer waits after a new award to gather more
+TOKEN_BATCH_SIZE = int(os.getenv("TOKEN_BATCH_SIZE", "500"))
+TOKEN_FLUSH_INTERVAL = float(os.getenv("TOKEN_FLUSH_INTERVAL", "0.2"))
+# How often the writer looks for unapplied rows without being notified, e.g. left by another worker or a crash
+TOKEN_SWEEP_INTERVAL = float(os.getenv("TOKEN_SWEEP_INTERVAL", "5"))
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "100"))
+# Ledger reasons given through the API are stored under this prefix, so they can't pass for the app's own
+MANUAL_REASON_PREFIX = "manual:"
+
+log = logging.getLogger("foodbridge.tokens")
+
+
+class Leaderboard:
+    """
+    The top users by token_count, kept sorted in memory.
+
+    Increases are applied as they happen. A decrease for someone on a full
+    board means a user below it may now rank higher, so that marks the board
+    stale and it is reloaded from the token_count index on the next read.
+    """
+
+    def __init__(self, size: int = LEADERBOARD_SIZE, ttl_seconds: float = 60):
+        self.size = size
+        self.ttl_seconds = ttl_seconds
+        self._entries = []  # (-token_count, user_id), so ties rank the same way as the SQL ordering
+        self._users = {}  # user_id -> (name, token_count)
+        self._loaded_at = None
+
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl_seconds
+
+    def load(self, rows):
+        """Replace the board with (user_id, name, token_count) rows."""
+        self._users = {user_id: (name, token_count or 0) for user_id, name, token_count in rows}
+        self._entries = sorted((-token_count, user_id) for user_id, (_, token_count) in self._users.items())
+        self._loaded_at = time.monotonic()
+
+    def update(self, user_id: str, name: str, token_count: int):
+        """Apply a user's new balance."""
+        if self.is_stale():
+            return
+        token_count = token_count or 0
+        key = (-token_count, user_id)
+        current = self._users.get(user_id)
+        if current is not None:
+            if token_count < current[1] and len(self._entries) >= self.size:
+                self._loaded_at = None
+                return
+            self._entries.pop(bisect.bisect_left(self._entries, (-current[1], user_id)))
+        elif len(self._entries) >= self.size:
+            if key >= self._entries[-1]:
+                return
+            _, evicted = self._entries.pop()
+            del self._users[evicted]
+        bisect.insort(self._entries, key)
+        self._users[user_id] = (name, token_count)
+
+    def top(self, limit: int) -> list[tuple[str, str, int]]:
+        """(user_id, name, token_count) for the best `limit` users, highest first."""
+        return [(user_id, self._users[user_id][0], -score) for score, user_id in self._entries[:limit]]
+
+
+class TokenWriter:
+    """
+    Applies token awards to users.token_count in batches.
+
+    Awards are written as unapplied ledger rows in the same transaction as
+    whatever earned them, which is just an insert. This writer then sums a
+    batch of rows per user and applies them with one UPDATE per user per batch,
+    so a burst of awards doesn't queue up on the same users rows. Rows are
+    claimed with a compare-and-set on applied, so several workers can run one.
+    """
+
+    def __init__(self, batch_size: int = TOKEN_BATCH_SIZE, flush_interval: float = TOKEN_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def notify(self):
+        """Tell the writer there are new awards to apply."""
+        self._wake.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), TOKEN_SWEEP_INTERVAL)
+                await asyncio.sleep(self.flush_interval)  # Let a burst build up into one batch
+            except TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Applying token awards failed, will retry")
+
+    async def flush(self) -> int:
+        """Apply unapplied ledger rows until there are none left. Returns how many were applied."""
+        applied = 0
+        while True:
+            count = await self.apply_batch()
+            applied += count
+            if count < self.batch_size:
+                return applied
+
+    async def apply_batch(self) -> int:
+        ledger = models.TokenLedger
+        users = models.User.__table__
+        async with database.AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(ledger.id, ledger.user_id, ledger.delta)
+                .where(ledger.applied == False)  # noqa: E712
+                .order_by(ledger.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )).all()
+            if not rows:
+                return 0
+
+            claimed = await db.execute(
+                update(ledger).where(ledger.id.in_([row.id for row in rows]), ledger.applied == False)  # noqa: E712
+                .values(applied=True)
+            )
+            if claimed.rowcount != len(rows):
+                await db.rollback()  # Another worker got some of them; it will apply them
+                return 0
+
+            totals = defaultdict(int)
+            for row in rows:
+                totals[row.user_id] += row.delta
+            # Users in a fixed order, so concurrent batches lock rows in the same order
+            await db.execute(
+                update(users)
+                .where(users.c.id == bindparam("target_id"))
+                .values(token_count=func.coalesce(users.c.token_count, 0) + bindparam("total")),
+                [{"target_id": user_id, "total": total} for user_id, total in sorted(totals.items())],
+            )
+            balances = (await db.execute(
+                select(users.c.id, users.c.name, users.c.token_count).where(users.c.id.in_(totals))
+            )).all()
+            await db.commit()
+
+        await versions.bump(versions.TOKEN_COUNTS)
+        for user_id, name, token_count in balances:
+            leaderboard.update(user_id, name, token_count)
+        return len(rows)
+
+
+# Shared per-process instances; the writer is started and stopped by the app lifespan
+leaderboard = Leaderboard()
+token_writer = TokenWriter()
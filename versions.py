@@ -0,0 +1,93 @@
+"""
+Version stamps for conditional GETs.
+
+Write paths bump the scopes they change (a centre's requests, a request's
+food items, ...) and polling endpoints derive a weak ETag from the scopes they
+read, so a client whose If-None-Match still matches gets a 304 without a
+query or any serialisation. Stamps live in the cache backend; with several
+workers set CACHE_URL so every worker sees every bump.
+
+A stamp is the time of the last bump in nanoseconds, so values never repeat
+after a restart or eviction, and a recent bump can be told apart from an old
+one: replicas may not have the change yet, so no ETag is given out for data
+read from a replica until READ_YOUR_WRITES_SECONDS after a bump.
+"""
+import hashlib
+import time
+from datetime import date
+
+from fastapi import Request
+
+import database
+from cache import backend
+
+# Stamps are refreshed on every bump; one that lapses is recreated and clients refetch once
+VERSION_TTL = 7 * 24 * 3600
+
+TOKEN_COUNTS = ("token_counts",)
+COMMUNITY_CENTRES = ("community_centres",)
+
+
+def slot_scope(day: date, meal_type: str) -> tuple:
+    """Requirements for one meal window, as served by /requirements/today/."""
+    return ("requirements", day.isoformat(), meal_type)
+
+
+def centre_requests_scope(centre_id: str) -> tuple:
+    return ("centre_requests", centre_id)
+
+
+def food_items_scope(request_id: str) -> tuple:
+    return ("food_items", request_id)
+
+
+def _key(scope: tuple) -> str:
+    return ":".join(["version", *(str(part) for part in scope)])
+
+
+async def bump(*scopes):
+    stamp = time.time_ns()
+    for scope in set(scopes):
+        await backend.set(_key(scope), stamp, time.time() + VERSION_TTL)
+
+
+async def requirements_changed(keys):
+    """Bump the scopes showing requirements, for (centre_id, date, meal_type) keys."""
+    scopes = set()
+    for centre_id, day, meal_type in keys:
+        scopes.update((slot_scope(day, meal_type), centre_requests_scope(centre_id)))
+    await bump(*scopes)
+
+
+async def current(*scopes) -> list[int]:
+    keys = [_key(scope) for scope in scopes]
+    stamps = await backend.get_many(keys)
+    for i, stamp in enumerate(stamps):
+        if stamp is None:
+            stamps[i] = await backend.add(keys[i], time.time_ns(), time.time() + VERSION_TTL)
+    return stamps
+
+
+async def etag(request: Request, scopes, extra=(), replica: bool = True) -> str | None:
+    """
+    Weak ETag for a response built from scopes (plus any extra values it
+    depends on), or None if it shouldn't have one. Read it before querying:
+    a write that lands in between then makes the tag stale rather than wrong.
+    """
+    stamps = await current(*scopes)
+    if replica and database.replica_engines and not database.reads_from_primary(request):
+        if time.time_ns() - max(stamps) < database.READ_YOUR_WRITES_SECONDS * 1_000_000_000:
+            return None
+    digest = hashlib.sha1(":".join(str(part) for part in [*stamps, *extra]).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def matches(request: Request, tag: str) -> bool:
+    """Weak comparison of tag against the request's If-None-Match."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = tag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in header.split(","))